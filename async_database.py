@@ -0,0 +1,62 @@
+import asyncio
+import contextvars
+import functools
+from concurrent.futures import ThreadPoolExecutor
+import config
+from database import Database
+
+
+class AsyncDatabase:
+    """Асинхронная обертка над Database: чтение в пуле потоков, запись через один поток-писатель"""
+
+    READ_METHODS = {
+        "get_user", "get_user_by_id", "get_nickname", "can_send_card", "get_user_stats",
+        "get_user_card_ids", "get_user_cards", "get_rich_top", "get_record_holder",
+        "get_user_rank", "get_card_file_ids", "get_broadcast", "get_running_broadcasts",
+        "get_broadcast_recipients", "get_card_notifications", "get_card_draws", "get_draw_counts",
+        "has_card", "get_missing_card_ids",
+    }
+    WRITE_METHODS = {
+        "create_user", "set_nickname", "set_nicknames", "add_user_card", "add_ufcoins",
+        "draw_card", "create_promo_code", "activate_promo_code", "update_user_activity",
+        "set_card_file_id", "delete_card_file_id", "create_broadcast", "save_broadcast_progress",
+        "set_users_blocked", "set_card_notifications", "rollup_card_draws",
+    }
+
+    def __init__(self, db: Database, readers: int = config.DB_READERS):
+        self.sync = db
+        self._readers = ThreadPoolExecutor(max_workers=max(1, readers), thread_name_prefix="db-reader")
+        # Один поток и его очередь задач: записи идут строго по порядку и не ждут друг друга в event loop
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+
+    async def run_read(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        # Контекст апдейта переезжает в поток вместе с вызовом: по нему считаются запросы на апдейт
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(self._readers, functools.partial(context.run, func, *args, **kwargs))
+
+    async def run_write(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(self._writer, functools.partial(context.run, func, *args, **kwargs))
+
+    def __getattr__(self, name):
+        if name in self.READ_METHODS:
+            runner = self.run_read
+        elif name in self.WRITE_METHODS:
+            runner = self.run_write
+        else:
+            raise AttributeError(name)
+
+        method = getattr(self.sync, name)
+
+        async def call(*args, **kwargs):
+            return await runner(method, *args, **kwargs)
+
+        call.__name__ = name
+        return call
+
+    def close(self):
+        # Дожидаемся уже поставленных в очередь записей
+        self._writer.shutdown(wait=True)
+        self._readers.shutdown(wait=True)
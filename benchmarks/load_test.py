@@ -0,0 +1,274 @@
+"""
+Нагрузочный тест бота целиком: синтетические апдейты идут в настоящий Dispatcher.feed_update,
+Bot API подменен локальной заглушкой, база - временный sync_bot.db.
+Считает пропускную способность и p50/p95/p99 по каждому действию, сравнивает с сохраненным baseline.
+
+    python benchmarks/load_test.py --users 2000 --concurrency 200
+    python benchmarks/load_test.py --save-baseline        # запомнить текущие цифры
+
+load_test_baseline.json в репозитории снят с настройками по умолчанию; на другом железе
+сначала перезапишите его через --save-baseline.
+"""
+import argparse
+import asyncio
+import datetime
+import itertools
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.types import CallbackQuery, Chat, Message, PhotoSize, Update, User
+from catalog import catalog
+from database import Database
+from telegram_bot import TelegramBot
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "load_test_baseline.json")
+BOT_TOKEN = "123456:BENCH"
+BOT_USERNAME = "ufcards_bench_bot"
+MESSAGE_METHODS = {"SendMessage", "SendPhoto", "EditMessageMedia", "EditMessageText", "EditMessageCaption"}
+PHOTO_METHODS = {"SendPhoto", "EditMessageMedia"}
+
+
+class StubSession(BaseSession):
+    """Bot API без сети: отвечает правдоподобными объектами и помнит последнюю клавиатуру в каждом чате"""
+
+    def __init__(self, latency: float = 0.0):
+        super().__init__()
+        self.latency = latency
+        self.ids = itertools.count(1)
+        self.calls = 0
+        self.markups = {}
+
+    async def close(self):
+        pass
+
+    async def stream_content(self, *args, **kwargs):
+        yield b""
+
+    async def make_request(self, bot, method, timeout=None):
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        name = type(method).__name__
+        if name == "GetMe":
+            # Нужен фильтру Command для команд с упоминанием: /top@bot
+            return User(id=bot.id, is_bot=True, first_name="UFCards", username=BOT_USERNAME)
+        if name not in MESSAGE_METHODS:
+            return True
+
+        chat_id = getattr(method, "chat_id", None) or 1
+        message_id = next(self.ids)
+        if getattr(method, "reply_markup", None) is not None:
+            self.markups[chat_id] = (message_id, method.reply_markup)
+        photo = None
+        if name in PHOTO_METHODS:
+            photo = [PhotoSize(file_id=f"file-{message_id}", file_unique_id=f"u{message_id}", width=1, height=1)]
+        return Message(
+            message_id=message_id,
+            date=datetime.datetime.now(),
+            chat=Chat(id=chat_id, type="private"),
+            photo=photo
+        )
+
+
+class LoadTest:
+    def __init__(self, tb: TelegramBot, session: StubSession):
+        self.tb = tb
+        self.session = session
+        self.update_ids = itertools.count(1)
+        self.latencies = {}
+
+    def _user(self, tg_id: int) -> User:
+        return User(id=tg_id, is_bot=False, first_name=f"bench{tg_id}")
+
+    def message(self, tg_id: int, text: str) -> Update:
+        update_id = next(self.update_ids)
+        return Update(update_id=update_id, message=Message(
+            message_id=update_id,
+            date=datetime.datetime.now(),
+            chat=Chat(id=tg_id, type="private"),
+            from_user=self._user(tg_id),
+            text=text
+        ))
+
+    def callback(self, tg_id: int, data: str, message_id: int = 1) -> Update:
+        update_id = next(self.update_ids)
+        return Update(update_id=update_id, callback_query=CallbackQuery(
+            id=str(update_id),
+            from_user=self._user(tg_id),
+            chat_instance="bench",
+            data=data,
+            message=Message(message_id=message_id, date=datetime.datetime.now(), chat=Chat(id=tg_id, type="private"))
+        ))
+
+    async def feed(self, action: str, update: Update):
+        started = time.perf_counter()
+        await self.tb.dp.feed_update(self.tb.bot, update)
+        self.latencies.setdefault(action, []).append(time.perf_counter() - started)
+
+    async def flip(self, tg_id: int):
+        # Листаем коллекцию кнопкой из последней клавиатуры, которую бот отправил игроку
+        sent = self.session.markups.get(tg_id)
+        if not sent:
+            return
+        message_id, markup = sent
+        data = markup.inline_keyboard[0][-1].callback_data
+        await self.feed("mycards_flip", self.callback(tg_id, data, message_id))
+
+    async def returning_player(self, tg_id: int):
+        await self.feed("stats", self.message(tg_id, "стата"))
+        await self.feed("card", self.message(tg_id, "карта"))
+        await self.feed("top", self.message(tg_id, "топ"))
+        await self.feed("top_mention", self.message(tg_id, f"/top@{BOT_USERNAME}"))
+        await self.feed("code", self.message(tg_id, "/code BENCH"))
+        await self.feed("mycards", self.message(tg_id, "/mycards"))
+        await self.flip(tg_id)
+        await self.flip(tg_id)
+
+    async def new_player(self, tg_id: int):
+        await self.feed("start", self.message(tg_id, "/start"))
+        await self.feed("start_game", self.callback(tg_id, "start_game"))
+        await self.feed("nickname", self.message(tg_id, f"new{tg_id}"))
+        await self.feed("card", self.message(tg_id, "карта"))
+
+
+def seed(db: Database, users: int, cards_per_user: int):
+    card_ids = [card["id"] for card in catalog.cards]
+    rng = random.Random(1)
+    for user_id in range(1, users + 1):
+        db.create_user(tg_id=user_id, username=f"bench{user_id}")
+    db.set_nicknames([(user_id, f"bench{user_id}") for user_id in range(1, users + 1)])
+    for user_id in range(1, users + 1):
+        for card_id in rng.sample(card_ids, cards_per_user):
+            db.add_user_card(user_id, card_id)
+    # add_user_card ставит кулдаун - снимаем его, чтобы "карта" доходила до выдачи
+    with db.pool.writer() as conn:
+        conn.execute("UPDATE users SET last_card_time = 0")
+    db.reload_cooldowns()
+    db.create_promo_code("BENCH", 10, users // 2, "@bench")
+
+
+def percentile(values: list, q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+def summarize(latencies: dict, elapsed: float) -> dict:
+    total = sum(len(values) for values in latencies.values())
+    return {
+        "updates": total,
+        "updates_per_sec": total / elapsed,
+        "actions": {
+            action: {
+                "count": len(values),
+                "p50_ms": percentile(values, 0.50) * 1000,
+                "p95_ms": percentile(values, 0.95) * 1000,
+                "p99_ms": percentile(values, 0.99) * 1000,
+            }
+            for action, values in sorted(latencies.items())
+        },
+    }
+
+
+def compare(result: dict, baseline: dict, tolerance: float) -> bool:
+    ok = True
+    base_rate = baseline["updates_per_sec"]
+    if result["updates_per_sec"] < base_rate * (1 - tolerance):
+        print(f"❌ throughput {result['updates_per_sec']:.0f}/s < baseline {base_rate:.0f}/s")
+        ok = False
+    for action, stats in result["actions"].items():
+        base = baseline["actions"].get(action)
+        if base and stats["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            print(f"❌ {action}: p95 {stats['p95_ms']:.2f}ms > baseline {base['p95_ms']:.2f}ms")
+            ok = False
+    return ok
+
+
+async def run(args) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, "sync_bot.db"))
+        try:
+            return await run_scenarios(args, db)
+        finally:
+            # Останавливаем поток отложенной записи и дописываем буфер до удаления временной базы
+            db.close()
+
+
+async def run_scenarios(args, db: Database) -> dict:
+    seed(db, args.users, args.cards)
+
+    tb = TelegramBot(BOT_TOKEN, db)
+    session = StubSession(args.api_latency / 1000)
+    tb.bot = Bot(BOT_TOKEN, session=session, default=tb.bot.default)
+    if args.with_sender:
+        session.middleware(tb.sender)
+    test = LoadTest(tb, session)
+
+    try:
+        scenarios = [test.returning_player(tg_id) for tg_id in range(1, args.users + 1)]
+        scenarios += [test.new_player(tg_id) for tg_id in range(args.users + 1, args.users + args.new_users + 1)]
+        random.Random(2).shuffle(scenarios)
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def limited(scenario):
+            async with semaphore:
+                await scenario
+
+        started = time.perf_counter()
+        await asyncio.gather(*(limited(scenario) for scenario in scenarios))
+        elapsed = time.perf_counter() - started
+
+        result = summarize(test.latencies, elapsed)
+        result["throttled"] = tb.throttling.get_stats()["throttled"]
+        result["api_calls"] = session.calls
+        return result
+    finally:
+        tb.db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=2000, help="игроки с ником и коллекцией")
+    parser.add_argument("--new-users", type=int, default=200, help="новые игроки: /start, кнопка, ввод ника")
+    parser.add_argument("--cards", type=int, default=5, help="карточек в коллекции у каждого игрока")
+    parser.add_argument("--concurrency", type=int, default=200, help="сколько игроков действуют одновременно")
+    parser.add_argument("--api-latency", type=float, default=0, help="задержка ответа заглушки Bot API, мс")
+    parser.add_argument("--with-sender", action="store_true", help="пропускать исходящие через SendScheduler")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="допустимое ухудшение относительно baseline")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+
+    print(f"updates: {result['updates']}, {result['updates_per_sec']:.0f} updates/s, api calls: {result['api_calls']}")
+    print(f"{'action':<14}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for action, stats in result["actions"].items():
+        print(f"{action:<14}{stats['count']:>8}{stats['p50_ms']:>10.2f}{stats['p95_ms']:>10.2f}{stats['p99_ms']:>10.2f}")
+    throttled = sum(result["throttled"].values())
+    if throttled:
+        print(f"throttled: {result['throttled']}")
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"baseline saved to {args.baseline}")
+        return 0
+    if not os.path.exists(args.baseline):
+        print("no baseline yet, run with --save-baseline")
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    ok = compare(result, baseline, args.tolerance)
+    print("✅ OK" if ok else "❌ slower than baseline")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,59 @@
+"""
+Нагрузочная проверка активации промокода: толпа игроков одновременно вводит один код.
+Проверяет, что активаций ровно max_activations и монеты начислены ровно столько раз.
+
+    python benchmarks/promo_activation.py --users 5000 --limit 1000 --threads 32
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from database import Database
+
+
+def run(users: int, limit: int, threads: int, attempts: int) -> bool:
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, "bench.db"))
+        with db.pool.writer() as conn:
+            conn.executemany("INSERT INTO users (tg_id, username) VALUES (?, ?)", [(i, f"u{i}") for i in range(1, users + 1)])
+        user_ids = list(range(1, users + 1))
+        db.create_promo_code("FLASH", 100, limit, "@bench")
+
+        # Каждый игрок шлет код attempts раз, плюс запросы с несуществующим кодом
+        calls = [(user_id, "FLASH") for user_id in user_ids for _ in range(attempts)]
+        calls += [(user_id, "NOPE") for user_id in user_ids[: users // 10]]
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            results = list(pool.map(lambda call: db.activate_promo_code(*call)[0], calls))
+        elapsed = time.perf_counter() - started
+
+        with db.pool.reader() as conn:
+            current = conn.execute("SELECT current_activations FROM promo_codes WHERE code = 'FLASH'").fetchone()[0]
+            rows = conn.execute("SELECT COUNT(*) FROM user_promo_codes").fetchone()[0]
+            coins = conn.execute("SELECT SUM(ufcoins) FROM users").fetchone()[0]
+        db.close()
+
+    successes = sum(results)
+    expected = min(limit, users)
+    print(f"calls: {len(calls)}, threads: {threads}, time: {elapsed:.2f}s, {len(calls) / elapsed:.0f} calls/s")
+    print(f"successes: {successes}, current_activations: {current}, user_promo_codes: {rows}, coins: {coins}")
+    print(f"fast rejects (no disk): {db.promo.fast_rejects}")
+
+    ok = successes == current == rows == expected and coins == expected * 100
+    print("✅ OK" if ok else f"❌ FAIL: expected exactly {expected} activations")
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--limit", type=int, default=1000)
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--attempts", type=int, default=2)
+    args = parser.parse_args()
+    sys.exit(0 if run(args.users, args.limit, args.threads, args.attempts) else 1)
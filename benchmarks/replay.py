@@ -0,0 +1,184 @@
+"""
+Проигрывание записанного потока апдейтов (RECORD_UPDATES=1) через настоящий Dispatcher
+против копии снимка базы. Паузы между апдейтами сохраняются, их можно ускорить.
+
+    python benchmarks/replay.py recordings/updates.jsonl --db snapshot.db --speed 1
+    python benchmarks/replay.py recordings/updates.jsonl --db snapshot.db --speed 10
+    python benchmarks/replay.py recordings/updates.jsonl --db snapshot.db --speed 0   # как можно быстрее
+"""
+import argparse
+import asyncio
+import glob
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import config
+from aiogram import Bot
+from aiogram.types import Update
+from database import Database
+from recorder import anonymize_id
+from telegram_bot import TelegramBot
+from load_test import StubSession, compare, summarize
+
+
+def recording_files(path: str) -> list:
+    """Файл и его ротации, от самой старой к самой новой"""
+    rotated = sorted(glob.glob(f"{glob.escape(path)}.*"), key=lambda name: int(name.rsplit(".", 1)[1]), reverse=True)
+    return rotated + ([path] if os.path.exists(path) else [])
+
+
+def load_recording(paths: list, bot: Bot, limit: int = None) -> list:
+    events = []
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                item = json.loads(line)
+                events.append((item["t"], Update.model_validate(item["update"], context={"bot": bot})))
+                if limit and len(events) >= limit:
+                    return events
+    return events
+
+
+def prepare_snapshot(source: str, target: str, salt: bytes):
+    """Копия снимка с теми же анонимными tg_id, что и в записи"""
+    shutil.copy(source, target)
+    if not salt:
+        return
+    conn = sqlite3.connect(target)
+    conn.create_function("anonymize_id", 1, lambda value: anonymize_id(value, salt) if value else value)
+    conn.execute("UPDATE users SET tg_id = anonymize_id(tg_id)")
+    conn.commit()
+    conn.close()
+
+
+def classify(update: Update, aliases: dict) -> str:
+    if update.message and update.message.text:
+        text = update.message.text.strip().lower()
+        if text.startswith("/"):
+            return text.split(maxsplit=1)[0].split("@", 1)[0]
+        return "text:" + text if text in aliases else "text"
+    if update.callback_query:
+        return "callback:" + (update.callback_query.data or "").split(":", 1)[0]
+    return update.event_type
+
+
+async def replay(tb: TelegramBot, events: list, speed: float, concurrency: int) -> dict:
+    latencies = {}
+    lags = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def process(update: Update):
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                await tb.dp.feed_update(tb.bot, update)
+            except Exception as e:
+                print(f"Error replaying update {update.update_id}: {e}")
+            latencies.setdefault(classify(update, tb.text_commands), []).append(time.perf_counter() - started)
+
+    first = events[0][0]
+    started = time.perf_counter()
+    tasks = []
+    for recorded_at, update in events:
+        if speed > 0:
+            # Как в проде: апдейт приходит по расписанию записи, не дожидаясь обработки предыдущих
+            due = (recorded_at - first) / speed
+            delay = due - (time.perf_counter() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            lags.append(max(0.0, -delay))
+        tasks.append(asyncio.create_task(process(update)))
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+
+    result = summarize(latencies, elapsed)
+    result["recorded_seconds"] = events[-1][0] - first
+    result["max_dispatch_lag_ms"] = max(lags, default=0.0) * 1000
+    return result
+
+
+async def run(args) -> dict:
+    config.RECORD_UPDATES = False
+    salt = (args.salt if args.salt is not None else config.RECORD_SALT).encode()
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "sync_bot.db")
+        if args.db:
+            prepare_snapshot(args.db, db_path, salt)
+        db = Database(db_path)
+        try:
+            return await run_replay(args, db)
+        finally:
+            db.close()
+
+
+async def run_replay(args, db: Database) -> dict:
+    tb = TelegramBot("123456:REPLAY", db)
+    session = StubSession(args.api_latency / 1000)
+    tb.bot = Bot("123456:REPLAY", session=session, default=tb.bot.default)
+    if args.with_sender:
+        session.middleware(tb.sender)
+
+    try:
+        events = load_recording(recording_files(args.recording), tb.bot, args.limit)
+        if not events:
+            raise SystemExit(f"no updates in {args.recording}")
+        print(f"replaying {len(events)} updates at {'max speed' if args.speed <= 0 else f'{args.speed:g}x'}")
+
+        result = await replay(tb, events, args.speed, args.concurrency)
+        result["throttled"] = tb.throttling.get_stats()["throttled"]
+        result["api_calls"] = session.calls
+        return result
+    finally:
+        tb.db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("recording", nargs="?", default=config.RECORD_PATH, help="JSONL-файл записи (ротации подхватываются)")
+    parser.add_argument("--db", help="снимок базы; без него - пустая база")
+    parser.add_argument("--salt", help="RECORD_SALT, с которым делалась запись")
+    parser.add_argument("--speed", type=float, default=1.0, help="1 - как было, N - в N раз быстрее, 0 - без пауз")
+    parser.add_argument("--concurrency", type=int, default=1000, help="сколько апдейтов обрабатывается одновременно")
+    parser.add_argument("--limit", type=int, help="проиграть только первые N апдейтов")
+    parser.add_argument("--api-latency", type=float, default=0, help="задержка ответа заглушки Bot API, мс")
+    parser.add_argument("--with-sender", action="store_true", help="пропускать исходящие через SendScheduler")
+    parser.add_argument("--baseline", help="JSON с прошлым результатом для сравнения")
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+
+    print(f"updates: {result['updates']} over {result['recorded_seconds']:.0f}s recorded, "
+          f"{result['updates_per_sec']:.0f} updates/s, api calls: {result['api_calls']}, "
+          f"max dispatch lag: {result['max_dispatch_lag_ms']:.1f}ms")
+    print(f"{'update':<24}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for action, stats in result["actions"].items():
+        print(f"{action[:23]:<24}{stats['count']:>8}{stats['p50_ms']:>10.2f}{stats['p95_ms']:>10.2f}{stats['p99_ms']:>10.2f}")
+    if sum(result["throttled"].values()):
+        print(f"throttled: {result['throttled']}")
+
+    if not args.baseline:
+        return 0
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"baseline saved to {args.baseline}")
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    ok = compare(result, baseline, args.tolerance)
+    print("✅ OK" if ok else "❌ slower than baseline")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
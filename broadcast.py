@@ -0,0 +1,138 @@
+import asyncio
+import time
+from aiogram import Bot
+from aiogram.exceptions import TelegramForbiddenError, TelegramBadRequest
+from async_database import AsyncDatabase
+from sender import bulk_sends
+
+
+class Broadcaster:
+    """Фоновая рассылка всем игрокам: пачками по user_id, с сохранением прогресса в базе"""
+
+    def __init__(self, bot: Bot, db: AsyncDatabase, rate: float = 20, batch_size: int = 500,
+                 checkpoint_sends: int = 20, checkpoint_interval: float = 2):
+        self.bot = bot
+        self.db = db
+        self.rate = rate
+        self.batch_size = batch_size
+        self.checkpoint_sends = checkpoint_sends
+        self.checkpoint_interval = checkpoint_interval
+        self._tasks = {}
+
+    def start(self, broadcast_id: int):
+        if broadcast_id in self._tasks:
+            return
+        task = asyncio.create_task(self._run(broadcast_id))
+        self._tasks[broadcast_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(broadcast_id, None))
+
+    async def resume(self) -> int:
+        """Продолжает рассылки, прерванные перезапуском"""
+        running = await self.db.get_running_broadcasts()
+        for broadcast_id in running:
+            self.start(broadcast_id)
+        return len(running)
+
+    async def _cancel_tasks(self) -> int:
+        # Прерванная задача сама сохраняет чекпоинт, поэтому дожидаемся ее
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        return len(tasks)
+
+    async def stop(self) -> int:
+        """Останавливает рассылки при выключении бота: статус остается running, после запуска они продолжатся"""
+        return await self._cancel_tasks()
+
+    async def cancel_all(self) -> int:
+        cancelled = await self._cancel_tasks()
+        for broadcast_id in await self.db.get_running_broadcasts():
+            data = await self.db.get_broadcast(broadcast_id)
+            await self.db.save_broadcast_progress(
+                broadcast_id, data["last_user_id"], data["sent"], data["failed"], data["blocked"], "cancelled"
+            )
+        return cancelled
+
+    async def _send(self, tg_id: int, text: str) -> str:
+        try:
+            with bulk_sends():
+                await self.bot.send_message(tg_id, text)
+            return "sent"
+        except TelegramForbiddenError:
+            return "blocked"
+        except TelegramBadRequest as e:
+            return "blocked" if "chat not found" in str(e).lower() else "failed"
+        except Exception:
+            return "failed"
+
+    async def _report(self, data: dict, status_message_id: int = None, finished: bool = False) -> int:
+        title = "✅ <b>рассылка завершена</b>" if finished else "📣 <b>рассылка идет...</b>"
+        text = f"""{title}
+
+<b>отправлено: {data['sent']}</b>
+<b>ошибок: {data['failed']}</b>
+<b>заблокировали бота: {data['blocked']}</b>"""
+        try:
+            if status_message_id:
+                await self.bot.edit_message_text(text, chat_id=data["report_chat_id"], message_id=status_message_id)
+                return status_message_id
+            message = await self.bot.send_message(data["report_chat_id"], text)
+            return message.message_id
+        except Exception:
+            return status_message_id
+
+    async def _checkpoint(self, broadcast_id: int, data: dict, blocked_ids: list):
+        if blocked_ids:
+            await self.db.set_users_blocked(blocked_ids)
+            blocked_ids.clear()
+        await self.db.save_broadcast_progress(
+            broadcast_id, data["last_user_id"], data["sent"], data["failed"], data["blocked"]
+        )
+
+    async def _run(self, broadcast_id: int):
+        data = await self.db.get_broadcast(broadcast_id)
+        if not data or data["status"] != "running":
+            return
+
+        status_message_id = await self._report(data)
+        interval = 1 / self.rate if self.rate > 0 else 0
+        blocked_ids = []
+        try:
+            while True:
+                recipients = await self.db.get_broadcast_recipients(data["last_user_id"], self.batch_size)
+                if not recipients:
+                    break
+
+                unsaved = 0
+                saved_at = time.monotonic()
+                for user_id, tg_id in recipients:
+                    started = time.monotonic()
+                    result = await self._send(tg_id, data["text"])
+                    data[result] += 1
+                    data["last_user_id"] = user_id
+                    if result == "blocked":
+                        blocked_ids.append(user_id)
+                    # Чекпоинт не зависит от размера пачки: после перезапуска повтор получат
+                    # не больше checkpoint_sends игроков (или отправленных за checkpoint_interval)
+                    unsaved += 1
+                    if unsaved >= self.checkpoint_sends or started - saved_at >= self.checkpoint_interval:
+                        await self._checkpoint(broadcast_id, data, blocked_ids)
+                        unsaved = 0
+                        saved_at = time.monotonic()
+                    delay = interval - (time.monotonic() - started)
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+
+                await self._checkpoint(broadcast_id, data, blocked_ids)
+                status_message_id = await self._report(data, status_message_id)
+
+            await self.db.save_broadcast_progress(
+                broadcast_id, data["last_user_id"], data["sent"], data["failed"], data["blocked"], "done"
+            )
+            await self._report(data, status_message_id, finished=True)
+        except asyncio.CancelledError:
+            await self._checkpoint(broadcast_id, data, blocked_ids)
+            raise
+        except Exception as e:
+            print(f"Error in broadcast {broadcast_id}: {e}")
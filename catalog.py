@@ -0,0 +1,204 @@
+import asyncio
+import json
+import os
+import random
+import time
+from datetime import datetime
+import config
+
+
+class AliasTable:
+    """Метод псевдонимов (Vose): выбор по весам за O(1) после подготовки за O(n)"""
+
+    def __init__(self, weights: list):
+        n = len(weights)
+        total = sum(weights)
+        if n == 0 or total <= 0:
+            raise ValueError("alias table needs at least one positive weight")
+
+        self.prob = [0.0] * n
+        self.alias = list(range(n))
+        scaled = [weight * n / total for weight in weights]
+        small = [i for i, p in enumerate(scaled) if p < 1]
+        large = [i for i, p in enumerate(scaled) if p >= 1]
+        while small and large:
+            s, l = small.pop(), large.pop()
+            self.prob[s] = scaled[s]
+            self.alias[s] = l
+            scaled[l] -= 1 - scaled[s]
+            (small if scaled[l] < 1 else large).append(l)
+        # Остатки из-за погрешности float - ровно единица
+        for i in small + large:
+            self.prob[i] = 1.0
+
+    def sample(self, rng=random) -> int:
+        i = int(rng.random() * len(self.prob))
+        return i if rng.random() < self.prob[i] else self.alias[i]
+
+
+def _timestamp(value) -> float:
+    if isinstance(value, (int, float)):
+        return float(value)
+    return datetime.fromisoformat(value).timestamp()
+
+
+def _check_weights(weights, label: str, errors: list):
+    if not isinstance(weights, dict):
+        errors.append(f"{label}: weights must be an object")
+        return
+    for key, weight in weights.items():
+        if isinstance(weight, bool) or not isinstance(weight, (int, float)) or weight < 0:
+            errors.append(f"{label}: bad weight {weight!r} for {key!r}")
+
+
+class CatalogState:
+    """Неизменяемый снимок каталога: перезагрузка подменяет его целиком одним присваиванием"""
+
+    def __init__(self, data: dict, base_dir: str):
+        self.weights = data.get("weights", {})
+        self.cards = []
+        errors = []
+        _check_weights(self.weights, "weights", errors)
+        seen = set()
+        for card in data.get("cards", []):
+            card = dict(card)
+            card_id = card.get("id")
+            if not isinstance(card_id, int) or card_id < 0:
+                errors.append(f"bad card id: {card_id!r}")
+                continue
+            if card_id in seen:
+                errors.append(f"duplicate card id {card_id}")
+            seen.add(card_id)
+            if card.get("coolness") not in self.weights:
+                errors.append(f"card {card_id}: unknown coolness {card.get('coolness')!r}")
+            if not isinstance(card.get("UFCoins"), int) or card["UFCoins"] < 0:
+                errors.append(f"card {card_id}: bad UFCoins {card.get('UFCoins')!r}")
+            card["image_path"] = os.path.join(base_dir, card.get("image_path", ""))
+            if not os.path.isfile(card["image_path"]):
+                errors.append(f"card {card_id}: image not found {card['image_path']}")
+            self.cards.append(card)
+
+        self.events = []
+        for event in data.get("events", []):
+            label = f"event {event.get('name', '')!r}"
+            try:
+                self.events.append((
+                    _timestamp(event["start"]),
+                    _timestamp(event["end"]),
+                    event.get("name", ""),
+                    event.get("weights", {}),
+                    {int(card_id): weight for card_id, weight in event.get("cards", {}).items()}
+                ))
+            except (AttributeError, KeyError, TypeError, ValueError) as e:
+                errors.append(f"bad {label}: {e}")
+                continue
+            _check_weights(self.events[-1][3], label, errors)
+            _check_weights(self.events[-1][4], f"{label} cards", errors)
+
+        if not self.cards:
+            errors.append("catalog has no cards")
+        if errors:
+            raise ValueError("; ".join(errors))
+
+        self.by_id = {card["id"]: card for card in self.cards}
+        self.by_coolness = {}
+        for card in self.cards:
+            self.by_coolness.setdefault(card["coolness"], []).append(card)
+        self.all_mask = sum(1 << card["id"] for card in self.cards)
+
+        self.table = self._build_table(self.weights, {}, "weights")
+        self.event_tables = [
+            (start, end, name, self._build_table({**self.weights, **weights}, card_weights, f"event {name!r}"))
+            for start, end, name, weights, card_weights in self.events
+        ]
+
+    def _build_table(self, weights: dict, card_weights: dict, label: str) -> AliasTable:
+        # Вес карточки = вес крутости поровну на всех бойцов этой крутости, с поправкой ивента.
+        # Нормировку делает AliasTable, он же отказывается от нулевой суммы весов
+        probabilities = [
+            weights.get(card["coolness"], 0) / len(self.by_coolness[card["coolness"]])
+            * card_weights.get(card["id"], 1)
+            for card in self.cards
+        ]
+        try:
+            return AliasTable(probabilities)
+        except ValueError:
+            raise ValueError(f"{label}: all card weights are zero") from None
+
+    def table_at(self, now: float) -> AliasTable:
+        for start, end, _, table in self.event_tables:
+            if start <= now < end:
+                return table
+        return self.table
+
+
+class Catalog:
+    """Каталог карточек из cards.json с проверкой картинок и перезагрузкой без перезапуска бота"""
+
+    def __init__(self, path: str = config.CARDS_FILE):
+        self.path = path
+        self._mtime = None
+        self._state = None
+        self.load()
+
+    def load(self):
+        mtime = os.path.getmtime(self.path)
+        with open(self.path, encoding="utf-8") as f:
+            data = json.load(f)
+        self._state = CatalogState(data, os.path.dirname(os.path.abspath(self.path)))
+        self._mtime = mtime
+
+    def reload_if_changed(self) -> bool:
+        """Перечитывает файл, если он изменился. При ошибке остается прежний каталог"""
+        try:
+            if os.path.getmtime(self.path) == self._mtime:
+                return False
+            self.load()
+            print(f"🃏 Card catalog reloaded: {len(self.cards)} cards")
+            return True
+        except (OSError, ValueError) as e:
+            print(f"Error reloading card catalog: {e}")
+            return False
+
+    async def watch(self, interval: float = 30):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self.reload_if_changed()
+            except Exception as e:
+                # Одна неудачная правка cards.json не должна навсегда остановить перезагрузку
+                print(f"Error in card catalog watcher: {e}")
+
+    @property
+    def cards(self) -> list:
+        return self._state.cards
+
+    @property
+    def weights(self) -> dict:
+        return self._state.weights
+
+    @property
+    def all_mask(self) -> int:
+        return self._state.all_mask
+
+    def get(self, card_id: int):
+        return self._state.by_id.get(card_id)
+
+    def by_coolness(self, coolness: str) -> list:
+        return self._state.by_coolness.get(coolness, [])
+
+    def active_event(self, now: float = None):
+        now = now if now is not None else time.time()
+        for start, end, name, _ in self._state.event_tables:
+            if start <= now < end:
+                return name
+        return None
+
+    def pick(self, rng=random, now: float = None) -> dict:
+        """Случайная карточка с учетом весов крутости и текущего ивента"""
+        state = self._state
+        now = now if now is not None else time.time()
+        return state.cards[state.table_at(now).sample(rng)]
+
+
+catalog = Catalog()
@@ -5,58 +5,74 @@ load_dotenv()
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DB_PATH = os.path.join(BASE_DIR, "sync_bot.db")
+# Сколько соединений-читателей держит пул Database
+DB_READERS = int(os.getenv("DB_READERS", "4"))
+# Кэш строк users: максимум записей и время жизни в секундах
+USER_CACHE_SIZE = 10000
+USER_CACHE_TTL = 300
+# Отложенная запись last_activity (и, по желанию, UFCoins из add_ufcoins): период сброса в секундах и размер буфера
+WRITE_BEHIND_INTERVAL = 0.5
+WRITE_BEHIND_MAX = 1000
+WRITE_BEHIND_COINS = False
+# Сколько секунд помнить, что промокода не существует
+PROMO_NEGATIVE_TTL = 30
+# Сырые события выдачи карточек старше стольких дней сворачиваются в дневные счетчики
+CARD_DRAWS_RETENTION_DAYS = 30
+# Сколько мест топа богачей держать в памяти
+LEADERBOARD_SIZE = 100
 
 TG_TOKEN = os.getenv("BOT_TOKEN")
 VK_TOKEN = os.getenv("VK_TOKEN", "")
+# Режим работы: "polling" или "webhook". Вебхук без WEBHOOK_SECRET не запускается.
+# Состояние ввода ника живет в памяти процесса (MemoryStorage), поэтому несколько воркеров
+# за одним WEBHOOK_URL требуют sticky-маршрутизации по пользователю
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or None
+WEBHOOK_MAX_CONCURRENT = int(os.getenv("WEBHOOK_MAX_CONCURRENT", "100"))
+# Лимиты исходящих сообщений (сообщений в секунду) и размер всплеска
+SEND_GLOBAL_RATE = 30
+SEND_CHAT_RATE = 1
+SEND_CHAT_BURST = 3
+SEND_GROUP_RATE = 20 / 60
+SEND_GROUP_BURST = 5
+# Рассылка /broadcast: сообщений в секунду и размер пачки получателей
+BROADCAST_RATE = 20
+BROADCAST_BATCH = 500
+# Прогресс рассылки сохраняется каждые N отправок или каждые M секунд: столько максимум получат повтор после перезапуска
+BROADCAST_CHECKPOINT_SENDS = 20
+BROADCAST_CHECKPOINT_INTERVAL = 2
+# Антиспам входящих: класс команды -> (токенов в секунду, размер всплеска) на игрока
+THROTTLE_LIMITS = {
+    "card": (0.5, 3),
+    "read": (1, 5),
+    "callback": (3, 10),
+    "default": (2, 10),
+}
+# Общий лимит входящих на чат-группу берется из SEND_GROUP_RATE / SEND_GROUP_BURST
+# Запись входящих апдейтов для benchmarks/replay.py (RECORD_UPDATES=1): анонимно, с ротацией файлов.
+# С одним и тем же RECORD_SALT id в записи совпадают с id в анонимизированном снимке базы
+RECORD_UPDATES = os.getenv("RECORD_UPDATES", "0") == "1"
+RECORD_PATH = os.getenv("RECORD_PATH", os.path.join(BASE_DIR, "recordings", "updates.jsonl"))
+RECORD_SALT = os.getenv("RECORD_SALT", "")
+RECORD_MAX_BYTES = 50 * 1024 * 1024
+RECORD_BACKUPS = 10
+# Метрики Prometheus (/metrics) на локальном порту; 0 - выключить
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))
+# Служебный чат, куда при старте заливаются картинки, чтобы прогреть кэш file_id (необязательно)
+MEDIA_CACHE_CHAT_ID = os.getenv("MEDIA_CACHE_CHAT_ID")
 
 # ВСЁ ОСТАЛЬНОЕ БЕЗ ИЗМЕНЕНИЙ ↓
 VK_GROUP_ID = 234356723
 ADMINS = ["nextxb", "yyangpython"]
 
-COOLNESS_WEIGHTS = {
-    "обычная": 70,
-    "жоская": 29,
-    "ИМБОВАЯ": 1
-}
-
 CARD_COOLDOWN = 10800
 
-# Все картинки будут искаться в папке проекта
-CARDS = [
-    {"id": 1, "name": "весёлый Ислам", "coolness": "обычная", "UFCoins": 50, "image_path": "веселый ислам.jpg"},
-    {"id": 2, "name": "Джонс с поясом", "coolness": "обычная", "UFCoins": 50, "image_path": "джонс с поясом.jpg"},
-    {"id": 3, "name": "качок Джонс", "coolness": "обычная", "UFCoins": 50, "image_path": "качок джонс.jpg"},
-    {"id": 4, "name": "Конор в кожанке", "coolness": "обычная", "UFCoins": 50, "image_path": "конор в дубленке.jpg"},
-    {"id": 5, "name": "удивленный Ислам", "coolness": "обычная", "UFCoins": 50, "image_path": "удивленный ислам.jpg"},
-    {"id": 6, "name": "Хабиб в метрошке", "coolness": "обычная", "UFCoins": 50, "image_path": "хабиб в метрошке.jpg"},
-    {"id": 7, "name": "Хабиб в парике", "coolness": "обычная", "UFCoins": 50, "image_path": "хабиб в шапке.jpg"},
-    {"id": 8, "name": "Чарльз где-то", "coolness": "обычная", "UFCoins": 50, "image_path": "чарльз где то.jpg"},
-    {"id": 9, "name": "Чарльз с пёсиком", "coolness": "обычная", "UFCoins": 50, "image_path": "чарльз с песиком.jpg"},
-    {"id": 10, "name": "шеф Конор", "coolness": "обычная", "UFCoins": 50, "image_path": "шеф Конор.jpg"},
-    {"id": 11, "name": "Илия на стадике", "coolness": "обычная", "UFCoins": 50, "image_path": "илия на стадике.jpg"},
-    {"id": 12, "name": "бизнесмен Арман", "coolness": "обычная", "UFCoins": 50, "image_path": "бизнесмен арман.jpg"},
-    {"id": 13, "name": "кричащий Волк", "coolness": "обычная", "UFCoins": 50, "image_path": "кричащий волк.jpg"},
-    {"id": 14, "name": "куряга Шон", "coolness": "обычная", "UFCoins": 50, "image_path": "куряга шон.jpg"},
-    {"id": 15, "name": "Пётр на трене", "coolness": "обычная", "UFCoins": 50, "image_path": "Пётр на трене.jpg"},
-    {"id": 16, "name": "Шара в капюшоне", "coolness": "обычная", "UFCoins": 50, "image_path": "шара в капюшоне.jpg"},
-    {"id": 17, "name": "безумный Пэдди", "coolness": "жоская", "UFCoins": 200, "image_path": "безумный пэдди.jpg"},
-    {"id": 18, "name": "богатый Конор", "coolness": "жоская", "UFCoins": 200, "image_path": "богатый конор.jpg"},
-    {"id": 19, "name": "боец Хасбик", "coolness": "жоская", "UFCoins": 200, "image_path": "боец хасбик.jpg"},
-    {"id": 20, "name": "добряк Джастин", "coolness": "жоская", "UFCoins": 200, "image_path": "добряк джастин.jpg"},
-    {"id": 21, "name": "Конор с тигром", "coolness": "жоская", "UFCoins": 200, "image_path": "конор с тигром.jpg"},
-    {"id": 22, "name": "мимимишный Хабиб", "coolness": "жоская", "UFCoins": 200, "image_path": "мимимишный хабиб.jpg"},
-    {"id": 23, "name": "Хабиб на фоне природы", "coolness": "жоская", "UFCoins": 200, "image_path": "хабиб на фоне природы.jpg"},
-    {"id": 24, "name": "Хамзат с пушкой", "coolness": "жоская", "UFCoins": 200, "image_path": "хамзат с пушкой.jpg"},
-    {"id": 25, "name": "Конор в Самаре", "coolness": "ИМБОВАЯ", "UFCoins": 1000, "image_path": "конор в самаре.jpg"}
-]
-
-# Преобразуем относительные пути в абсолютные
-for card in CARDS:
-    card["image_path"] = os.path.join(BASE_DIR, card["image_path"])
-
-CARDS_DICT = {card["id"]: card for card in CARDS}
-COOLNESS_CARDS = {
-    "обычная": [c for c in CARDS if c["coolness"] == "обычная"],
-    "жоская": [c for c in CARDS if c["coolness"] == "жоская"],
-    "ИМБОВАЯ": [c for c in CARDS if c["coolness"] == "ИМБОВАЯ"]
-}
+# Каталог карточек (веса крутости, ивенты, бойцы); картинки ищутся рядом с файлом.
+# Изменения подхватываются без перезапуска, файл проверяется раз в CATALOG_RELOAD_INTERVAL секунд
+CARDS_FILE = os.getenv("CARDS_FILE", os.path.join(BASE_DIR, "cards.json"))
+CATALOG_RELOAD_INTERVAL = 30
@@ -0,0 +1,80 @@
+import heapq
+import threading
+import time
+from typing import Tuple
+
+
+class CooldownIndex:
+    """Время готовности следующей карточки для каждого игрока и min-heap таймеров для подписчиков"""
+
+    def __init__(self, cooldown: int):
+        self.cooldown = cooldown
+        self._ready_at = {}
+        self._subscribers = {}
+        self._heap = []
+        self._lock = threading.Lock()
+
+    def load(self, rows):
+        """rows - (user_id, tg_id, last_card_time, notify_card)"""
+        with self._lock:
+            self._ready_at.clear()
+            self._subscribers.clear()
+            for user_id, tg_id, last_card_time, notify_card in rows:
+                if last_card_time:
+                    self._ready_at[user_id] = last_card_time + self.cooldown
+                if notify_card and tg_id:
+                    self._subscribers[user_id] = tg_id
+            now = time.time()
+            self._heap = [
+                (self._ready_at[user_id], user_id)
+                for user_id in self._subscribers
+                if self._ready_at.get(user_id, 0) > now
+            ]
+            heapq.heapify(self._heap)
+
+    def card_drawn(self, user_id: int, drawn_at: int):
+        with self._lock:
+            ready_at = drawn_at + self.cooldown
+            self._ready_at[user_id] = ready_at
+            if user_id in self._subscribers:
+                heapq.heappush(self._heap, (ready_at, user_id))
+
+    def subscribe(self, user_id: int, tg_id: int, enabled: bool = True):
+        with self._lock:
+            if not enabled:
+                # Запись в heap остается и будет пропущена при извлечении
+                self._subscribers.pop(user_id, None)
+                return
+            already_subscribed = user_id in self._subscribers
+            self._subscribers[user_id] = tg_id
+            if already_subscribed:
+                return
+            ready_at = self._ready_at.get(user_id, 0)
+            if ready_at > time.time():
+                heapq.heappush(self._heap, (ready_at, user_id))
+
+    def is_subscribed(self, user_id: int) -> bool:
+        return user_id in self._subscribers
+
+    def can_send(self, user_id: int) -> Tuple[bool, int]:
+        remaining = int(self._ready_at.get(user_id, 0) - time.time())
+        return remaining <= 0, max(0, remaining)
+
+    def next_due(self):
+        with self._lock:
+            return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now: float) -> list:
+        """Подписчики, у которых карточка готова к now: [(user_id, tg_id)]"""
+        due = {}
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                ready_at, user_id = heapq.heappop(self._heap)
+                # Устаревшие записи: игрок успел взять новую карточку или отписался
+                if self._ready_at.get(user_id) != ready_at or user_id not in self._subscribers:
+                    continue
+                due[user_id] = self._subscribers[user_id]
+        return list(due.items())
+
+    def __len__(self):
+        return len(self._heap)
@@ -1,320 +1,898 @@
+import random
 import sqlite3
 import time
+import queue
+import threading
+from contextlib import contextmanager
+from collections import OrderedDict, deque
 from typing import Tuple, Optional, List
-from functools import lru_cache
 import config
+from leaderboard import Leaderboard
+from cooldowns import CooldownIndex
+from promo_cache import PromoCodeCache
+from migrations import migrate
+from catalog import catalog
 
-class Database:
-    def __init__(self, path: str = config.DB_PATH):
+
+USER_COLUMNS = (
+    "user_id", "tg_id", "vk_id", "username", "nickname", "ufcoins",
+    "record_ufcoins", "last_card_time", "last_activity", "created_at", "blocked", "card_mask"
+)
+USER_SELECT = f"SELECT {', '.join(USER_COLUMNS)} FROM users"
+NICKNAME_COL = USER_COLUMNS.index("nickname")
+UFCOINS_COL = USER_COLUMNS.index("ufcoins")
+RECORD_UFCOINS_COL = USER_COLUMNS.index("record_ufcoins")
+LAST_ACTIVITY_COL = USER_COLUMNS.index("last_activity")
+BLOCKED_COL = USER_COLUMNS.index("blocked")
+CARD_MASK_COL = USER_COLUMNS.index("card_mask")
+
+
+def normalize_nickname(nickname: str) -> str:
+    # casefold, а не COLLATE NOCASE: NOCASE не различает регистр только у латиницы
+    return nickname.strip().casefold()
+
+
+def mask_from_blob(blob) -> int:
+    """Коллекция игрока хранится битовой маской: бит N установлен, если есть карточка с id N"""
+    return int.from_bytes(blob, "little") if blob else 0
+
+
+def mask_to_blob(mask: int) -> bytes:
+    return mask.to_bytes((mask.bit_length() + 7) // 8, "little")
+
+
+def mask_to_ids(mask: int) -> Tuple[int, ...]:
+    ids = []
+    while mask:
+        low = mask & -mask
+        ids.append(low.bit_length() - 1)
+        mask ^= low
+    return tuple(ids)
+
+
+def row_card_mask(row) -> int:
+    return mask_from_blob(row[CARD_MASK_COL]) if row else 0
+
+
+def missing_card_ids(mask: int) -> Tuple[int, ...]:
+    return mask_to_ids(catalog.all_mask & ~mask)
+
+
+def _statement_kind(sql: str) -> str:
+    return sql.lstrip().split(None, 1)[0].upper() if sql.strip() else "EMPTY"
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        hook = self.connection.pool.query_hook
+        if hook is None:
+            return super().execute(sql, parameters)
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            hook(_statement_kind(sql), time.perf_counter() - started)
+
+    def executemany(self, sql, seq_of_parameters):
+        hook = self.connection.pool.query_hook
+        if hook is None:
+            return super().executemany(sql, seq_of_parameters)
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            hook(_statement_kind(sql), time.perf_counter() - started)
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """Соединение, которое сообщает время каждого запроса в pool.query_hook(вид запроса, секунды)"""
+
+    pool = None
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+class ConnectionPool:
+    """Долгоживущие соединения с SQLite: один писатель и несколько читателей"""
+
+    def __init__(self, path: str, readers: int = 4, timeout: int = 30, cached_statements: int = 256):
         self.path = path
-        self.init_db()
+        # Необязательные хуки метрик: query_hook(вид запроса, секунды), wait_hook("reader"/"writer", секунды)
+        self.query_hook = None
+        self.wait_hook = None
+        self.timeout = timeout
+        self.cached_statements = cached_statements
+        self._stats_lock = threading.Lock()
+        self.stats = {
+            "connections": 0,
+            "reader_checkouts": 0,
+            "writer_checkouts": 0,
+            "reader_wait": 0.0,
+            "writer_wait": 0.0,
+        }
 
-    def get_conn(self):
-        conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self._writer_lock = threading.Lock()
+        self._writer = self.connect()
+        self._readers = queue.LifoQueue()
+        for _ in range(max(1, readers)):
+            self._readers.put(self.connect())
+
+    def connect(self) -> sqlite3.Connection:
+        # PRAGMA выполняются один раз на соединение, а не на каждый запрос
+        conn = sqlite3.connect(
+            self.path,
+            check_same_thread=False,
+            timeout=self.timeout,
+            cached_statements=self.cached_statements,
+            factory=InstrumentedConnection
+        )
+        conn.pool = self
         conn.execute("PRAGMA journal_mode=WAL")
         conn.execute("PRAGMA synchronous=NORMAL")
         conn.execute("PRAGMA foreign_keys=ON")
+        with self._stats_lock:
+            self.stats["connections"] += 1
         return conn
 
+    def _record(self, kind: str, waited: float):
+        with self._stats_lock:
+            self.stats[f"{kind}_checkouts"] += 1
+            self.stats[f"{kind}_wait"] += waited
+        if self.wait_hook:
+            self.wait_hook(kind, waited)
+
+    @contextmanager
+    def reader(self):
+        started = time.perf_counter()
+        conn = self._readers.get()
+        self._record("reader", time.perf_counter() - started)
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            self._readers.put(conn)
+
+    @contextmanager
+    def writer(self):
+        started = time.perf_counter()
+        self._writer_lock.acquire()
+        self._record("writer", time.perf_counter() - started)
+        try:
+            yield self._writer
+            if self._writer.in_transaction:
+                self._writer.commit()
+        except BaseException:
+            if self._writer.in_transaction:
+                self._writer.rollback()
+            raise
+        finally:
+            self._writer_lock.release()
+
+    def get_stats(self) -> dict:
+        with self._stats_lock:
+            return dict(self.stats)
+
+    def close(self):
+        with self._writer_lock:
+            self._writer.close()
+        while not self._readers.empty():
+            self._readers.get_nowait().close()
+
+
+class UserCache:
+    """LRU-кэш строк users с TTL: ключ user_id, плюс индексы tg_id и vk_id"""
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._rows = OrderedDict()
+        self._by_tg = {}
+        self._by_vk = {}
+        self._lock = threading.Lock()
+        # Растет при каждой инвалидации. Для игрока запоминается, при каком epoch его строку сбросили:
+        # строка, прочитанная до записи, не попадет в кэш после нее, а записи других игроков ей не мешают
+        self.epoch = 0
+        self._invalidated = {}
+        # Строки, прочитанные раньше этого epoch, не кэшируются (после очистки _invalidated)
+        self._floor = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _drop(self, user_id: int):
+        entry = self._rows.pop(user_id, None)
+        if entry:
+            row = entry[0]
+            self._by_tg.pop(row[1], None)
+            self._by_vk.pop(row[2], None)
+
+    def get(self, user_id: int = None, tg_id: int = None, vk_id: int = None):
+        with self._lock:
+            if user_id is None:
+                user_id = self._by_tg.get(tg_id) if tg_id else self._by_vk.get(vk_id)
+            entry = self._rows.get(user_id) if user_id is not None else None
+            if entry and entry[1] > time.monotonic():
+                self._rows.move_to_end(user_id)
+                self.hits += 1
+                return entry[0]
+            if entry:
+                self._drop(user_id)
+            self.misses += 1
+            return None
+
+    def put(self, row, epoch: int):
+        if not row:
+            return
+        with self._lock:
+            if epoch < self._floor or self._invalidated.get(row[0], -1) > epoch:
+                return
+            user_id = row[0]
+            self._drop(user_id)
+            self._rows[user_id] = (row, time.monotonic() + self.ttl)
+            if row[1]:
+                self._by_tg[row[1]] = user_id
+            if row[2]:
+                self._by_vk[row[2]] = user_id
+            while len(self._rows) > self.maxsize:
+                self._drop(next(iter(self._rows)))
+
+    def invalidate(self, user_id: int):
+        with self._lock:
+            self.epoch += 1
+            self._invalidated[user_id] = self.epoch
+            if len(self._invalidated) > self.maxsize:
+                self._invalidated.clear()
+                self._floor = self.epoch
+            self._drop(user_id)
+
+    def touch_activity(self, user_id: int, timestamp: int):
+        """Обновляет last_activity в закэшированной строке, не выбрасывая ее из кэша"""
+        with self._lock:
+            entry = self._rows.get(user_id)
+            if entry and (entry[0][LAST_ACTIVITY_COL] or 0) < timestamp:
+                row = list(entry[0])
+                row[LAST_ACTIVITY_COL] = timestamp
+                self._rows[user_id] = (tuple(row), entry[1])
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"size": len(self._rows), "hits": self.hits, "misses": self.misses}
+
+
+class WriteBehindBuffer:
+    """Копит частые мелкие записи (last_activity, приращения UFCoins, события выдачи карточек) и сбрасывает их одной транзакцией"""
+
+    def __init__(self, flush, interval: float = 0.5, max_entries: int = 1000):
+        self._flush = flush
+        self.interval = interval
+        self.max_entries = max_entries
+        self._activity = {}
+        self._coins = {}
+        self._draws = []
+        # То, что сейчас пишется: до коммита чтения видят это из буфера
+        self._activity_in_flight = {}
+        self._coins_in_flight = {}
+        self._lock = threading.Lock()
+        self._committed_cond = threading.Condition(self._lock)
+        # Номер коммита: нечетный, пока идет коммит. Строка, прочитанная при другом номере,
+        # могла уже включать монеты из in-flight - такую overlay просит перечитать
+        self.seq = 0
+        # (номер после коммита, игроки, чьи монеты он записал) для последних коммитов
+        self._commits = deque(maxlen=16)
+        self._wakeup = threading.Event()
+        self._closed = False
+        self.flushes = 0
+        self.flushed_entries = 0
+        self._thread = threading.Thread(target=self._run, name="db-write-behind", daemon=True)
+        self._thread.start()
+
+    def _added(self):
+        if len(self._activity) + len(self._coins) + len(self._draws) >= self.max_entries:
+            self._wakeup.set()
+
+    def touch(self, user_id: int, timestamp: int):
+        with self._lock:
+            self._activity[user_id] = max(timestamp, self._activity.get(user_id, 0))
+            self._added()
+
+    def add_coins(self, user_id: int, amount: int):
+        with self._lock:
+            self._coins[user_id] = self._coins.get(user_id, 0) + amount
+            self._added()
+
+    def log_draw(self, event: tuple):
+        """event - (user_id, card_id, coolness, coins, is_new, drawn_at)"""
+        with self._lock:
+            self._draws.append(event)
+            self._added()
+
+    def begin_commit(self):
+        """Вызывается писателем прямо перед COMMIT отложенных записей"""
+        with self._lock:
+            self.seq += 1
+
+    def end_commit(self, committed: bool = True):
+        """Вызывается писателем после COMMIT и сброса кэша, еще под блокировкой писателя"""
+        with self._lock:
+            self.seq += 1
+            if committed:
+                self._commits.append((self.seq, frozenset(self._coins_in_flight)))
+                self._activity_in_flight = {}
+                self._coins_in_flight = {}
+            else:
+                self._commits.append((self.seq, frozenset()))
+            self._committed_cond.notify_all()
+
+    def _stale(self, user_id: int, seq: int) -> bool:
+        if self.seq == seq and not seq % 2:
+            return False
+        if self.seq % 2 and user_id in self._coins_in_flight:
+            return True
+        if (self.seq - seq + 1) // 2 > len(self._commits):
+            return True
+        return any(user_id in users for end, users in self._commits if end > seq)
+
+    def overlay(self, row, seq: int = None):
+        """Строка users с учетом еще не записанных значений.
+
+        seq - self.seq до чтения строки. Если с тех пор коммит записал монеты этого игрока,
+        неизвестно, есть они в строке или нет: дожидаемся конца коммита и возвращаем None -
+        строку нужно прочитать заново.
+        """
+        if not row:
+            return row
+        user_id = row[0]
+        with self._lock:
+            if seq is not None and self._stale(user_id, seq):
+                self._committed_cond.wait_for(lambda: not self.seq % 2)
+                return None
+            activity = max(self._activity.get(user_id, 0), self._activity_in_flight.get(user_id, 0))
+            coins = self._coins.get(user_id, 0) + self._coins_in_flight.get(user_id, 0)
+        if not activity and not coins:
+            return row
+        row = list(row)
+        row[LAST_ACTIVITY_COL] = max(row[LAST_ACTIVITY_COL] or 0, activity)
+        if coins:
+            row[UFCOINS_COL] += coins
+            row[RECORD_UFCOINS_COL] = max(row[RECORD_UFCOINS_COL], row[UFCOINS_COL])
+        return tuple(row)
+
+    def flush(self):
+        with self._lock:
+            activity, self._activity = self._activity, {}
+            coins, self._coins = self._coins, {}
+            draws, self._draws = self._draws, []
+            self._activity_in_flight = activity
+            self._coins_in_flight = coins
+        if not activity and not coins and not draws:
+            return
+        try:
+            self._flush(activity, coins, draws)
+            self.flushes += 1
+            self.flushed_entries += len(activity) + len(coins) + len(draws)
+        except Exception as e:
+            print(f"Error flushing write-behind buffer: {e}")
+            # Возвращаем несохраненное обратно, попробуем в следующий раз.
+            # В той же блокировке убираем in-flight, иначе монеты посчитаются дважды
+            with self._lock:
+                for user_id, timestamp in activity.items():
+                    self._activity[user_id] = max(timestamp, self._activity.get(user_id, 0))
+                for user_id, amount in coins.items():
+                    self._coins[user_id] = self._coins.get(user_id, 0) + amount
+                self._draws[:0] = draws
+                self._activity_in_flight = {}
+                self._coins_in_flight = {}
+
+    def _run(self):
+        while not self._closed:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def close(self):
+        self._closed = True
+        self._wakeup.set()
+        self._thread.join()
+        self.flush()
+
+
+class Database:
+    def __init__(self, path: str = config.DB_PATH, readers: int = config.DB_READERS):
+        self.path = path
+        self.pool = ConnectionPool(path, readers=readers)
+        self.users = UserCache(config.USER_CACHE_SIZE, config.USER_CACHE_TTL)
+        self.leaderboard = Leaderboard(config.LEADERBOARD_SIZE)
+        self.cooldowns = CooldownIndex(config.CARD_COOLDOWN)
+        self.promo = PromoCodeCache(config.PROMO_NEGATIVE_TTL)
+        self.pending = WriteBehindBuffer(self._flush_pending, config.WRITE_BEHIND_INTERVAL, config.WRITE_BEHIND_MAX)
+        self.init_db()
+        self.reload_leaderboard()
+        self.reload_cooldowns()
+
+    def get_conn(self):
+        """Отдельное соединение вне пула (для скриптов обслуживания)"""
+        return self.pool.connect()
+
+    def close(self):
+        # Сначала дописываем отложенные записи, потом закрываем соединения
+        self.pending.close()
+        self.pool.close()
+
     def init_db(self):
-        conn = self.get_conn()
-        cur = conn.cursor()
-        cur.executescript('''
-            CREATE TABLE IF NOT EXISTS users (
-                user_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                tg_id INTEGER UNIQUE,
-                vk_id INTEGER UNIQUE,
-                username TEXT,
-                nickname TEXT UNIQUE,
-                ufcoins INTEGER DEFAULT 0,
-                record_ufcoins INTEGER DEFAULT 0,
-                last_card_time INTEGER DEFAULT 0,
-                last_activity INTEGER DEFAULT 0,
-                created_at INTEGER DEFAULT (strftime('%s','now'))
-            );
-
-            CREATE TABLE IF NOT EXISTS user_cards (
-                user_id INTEGER,
-                card_id INTEGER,
-                PRIMARY KEY (user_id, card_id)
-            );
-
-            CREATE TABLE IF NOT EXISTS promo_codes (
-                code_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                code TEXT UNIQUE NOT NULL,
-                coins INTEGER,
-                max_activations INTEGER,
-                current_activations INTEGER DEFAULT 0,
-                created_by TEXT,
-                created_at INTEGER,
-                is_active INTEGER DEFAULT 1
-            );
-
-            CREATE TABLE IF NOT EXISTS user_promo_codes (
-                user_id INTEGER,
-                code_id INTEGER,
-                activated_at INTEGER,
-                PRIMARY KEY (user_id, code_id)
-            );
-        ''')
-        columns_to_add = [
-            "last_card_time INTEGER DEFAULT 0",
-            "last_activity INTEGER DEFAULT 0"
-        ]
-        
-        for column_def in columns_to_add:
-            try:
-                column_name = column_def.split()[0]
-                cur.execute(f"SELECT {column_name} FROM users LIMIT 1")
-            except:
-                try:
-                    cur.execute(f"ALTER TABLE users ADD COLUMN {column_def}")
-                except:
-                    pass
-        
-        conn.commit()
-        conn.close()
+        # Если схема уже актуальна, это единственный запрос: PRAGMA user_version
+        with self.pool.writer() as conn:
+            migrate(conn)
 
-    @lru_cache(maxsize=10000)
     def get_user(self, tg_id: Optional[int] = None, vk_id: Optional[int] = None):
-        conn = self.get_conn()
-        cur = conn.cursor()
+        if not tg_id and not vk_id:
+            return None
         if tg_id:
-            cur.execute("SELECT * FROM users WHERE tg_id = ?", (tg_id,))
-        elif vk_id:
-            cur.execute("SELECT * FROM users WHERE vk_id = ?", (vk_id,))
-        row = cur.fetchone()
-        conn.close()
-        return row
+            return self._read_user(f"{USER_SELECT} WHERE tg_id = ?", tg_id, tg_id=tg_id)
+        return self._read_user(f"{USER_SELECT} WHERE vk_id = ?", vk_id, vk_id=vk_id)
+
+    def get_user_by_id(self, user_id: int):
+        return self._read_user(f"{USER_SELECT} WHERE user_id = ?", user_id, user_id=user_id)
+
+    def _read_user(self, query: str, value: int, **key):
+        while True:
+            seq = self.pending.seq
+            row = self.users.get(**key)
+            if not row:
+                epoch = self.users.epoch
+                with self.pool.reader() as conn:
+                    row = conn.execute(query, (value,)).fetchone()
+                self.users.put(row, epoch)
+            result = self.pending.overlay(row, seq)
+            # None - строку читали во время коммита монет этого игрока, перечитываем
+            if result is not None or not row:
+                return result
 
     def create_user(self, tg_id=None, vk_id=None, username="Unknown"):
-        conn = self.get_conn()
-        cur = conn.cursor()
         current_time = int(time.time())
         try:
-            cur.execute(
-                "INSERT OR IGNORE INTO users (tg_id, vk_id, username, created_at, last_activity) VALUES (?, ?, ?, ?, ?)", 
-                (tg_id, vk_id, username, current_time, current_time)
-            )
-            conn.commit()
-            user_id = cur.lastrowid
-            conn.close()
-            self.get_user.cache_clear()
+            with self.pool.writer() as conn:
+                conn.execute(
+                    "INSERT OR IGNORE INTO users (tg_id, vk_id, username, created_at, last_activity) VALUES (?, ?, ?, ?, ?)", 
+                    (tg_id, vk_id, username, current_time, current_time)
+                )
             return self.get_user(tg_id=tg_id, vk_id=vk_id)
         except Exception as e:
             print(f"Error creating user: {e}")
-            conn.close()
             return None
 
     def get_nickname(self, user_id: int) -> Optional[str]:
-        conn = self.get_conn()
-        cur = conn.cursor()
-        cur.execute("SELECT nickname FROM users WHERE user_id = ?", (user_id,))
-        row = cur.fetchone()
-        conn.close()
-        return row[0] if row else None
+        row = self.get_user_by_id(user_id)
+        return row[NICKNAME_COL] if row else None
+
+    def _apply_nickname(self, conn: sqlite3.Connection, user_id: int, nickname: str) -> bool:
+        """Проверка занятости и установка ника одним UPDATE: конфликт ловит уникальный индекс nickname_key"""
+        previous = conn.execute("SELECT nickname FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        try:
+            conn.execute(
+                "UPDATE users SET nickname = ?, nickname_key = ? WHERE user_id = ?",
+                (nickname, normalize_nickname(nickname), user_id)
+            )
+        except sqlite3.IntegrityError:
+            return False
+        self._update_leaderboard(conn, user_id, new_player=bool(previous) and previous[0] is None)
+        return True
 
     def set_nickname(self, user_id: int, nickname: str) -> Tuple[bool, str]:
-        conn = self.get_conn()
-        cur = conn.cursor()
         try:
-            cur.execute("SELECT 1 FROM users WHERE LOWER(nickname) = LOWER(?) AND user_id != ?", (nickname, user_id))
-            if cur.fetchone():
-                conn.close()
-                return False, "<b>❌ этот никнейм уже занят\n\n✏️ напишите новый никнейм:</b>"
-            
-            cur.execute("UPDATE users SET nickname = ? WHERE user_id = ?", (nickname, user_id))
-            conn.commit()
-            conn.close()
-            self.get_user.cache_clear()
+            with self.pool.writer() as conn:
+                if not self._apply_nickname(conn, user_id, nickname):
+                    return False, "<b>❌ этот никнейм уже занят\n\n✏️ напишите новый никнейм:</b>"
+            self.users.invalidate(user_id)
             return True, "<b>✅ никнейм успешно установлен</b>"
         except Exception as e:
-            conn.close()
             return False, f"<b>❌ Ошибка: {str(e)}</b>"
 
+    def set_nicknames(self, nicknames: List[Tuple[int, str]]) -> List[Tuple[int, bool]]:
+        """Массовое переименование одной транзакцией, для каждого игрока - удалось ли"""
+        results = []
+        with self.pool.writer() as conn:
+            for user_id, nickname in nicknames:
+                results.append((user_id, self._apply_nickname(conn, user_id, nickname)))
+        for user_id, _ in nicknames:
+            self.users.invalidate(user_id)
+        return results
+
     def can_send_card(self, user_id: int) -> Tuple[bool, int]:
-        conn = self.get_conn()
-        cur = conn.cursor()
-        cur.execute("SELECT last_card_time FROM users WHERE user_id = ?", (user_id,))
-        row = cur.fetchone()
-        conn.close()
-        
-        if not row or not row[0] or row[0] == 0:
-            return True, 0
-            
-        current_time = int(time.time())
-        last_card_time = row[0]
-        remaining = config.CARD_COOLDOWN - (current_time - last_card_time)
-        
-        return (remaining <= 0, max(0, remaining))
+        return self.cooldowns.can_send(user_id)
+
+    def reload_cooldowns(self):
+        with self.pool.reader() as conn:
+            rows = conn.execute(
+                "SELECT user_id, tg_id, last_card_time, notify_card FROM users WHERE last_card_time > 0 OR notify_card = 1"
+            ).fetchall()
+        self.cooldowns.load(rows)
+
+    def set_card_notifications(self, user_id: int, enabled: bool):
+        with self.pool.writer() as conn:
+            conn.execute("UPDATE users SET notify_card = ? WHERE user_id = ?", (int(enabled), user_id))
+            row = conn.execute("SELECT tg_id FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        if row:
+            self.cooldowns.subscribe(user_id, row[0], enabled)
+
+    def get_card_notifications(self, user_id: int) -> bool:
+        return self.cooldowns.is_subscribed(user_id)
 
     def add_user_card(self, user_id: int, card_id: int) -> bool:
-        conn = self.get_conn()
-        cur = conn.cursor()
-        
-        cur.execute("SELECT 1 FROM user_cards WHERE user_id = ? AND card_id = ?", (user_id, card_id))
-        exists = cur.fetchone()
-        
-        if not exists:
-            cur.execute("INSERT INTO user_cards (user_id, card_id) VALUES (?, ?)", (user_id, card_id))
-        
-        current_time = int(time.time())
-        cur.execute("UPDATE users SET last_card_time = ? WHERE user_id = ?", (current_time, user_id))
-        
-        conn.commit()
-        conn.close()
-        self.get_user.cache_clear()
+        with self.pool.writer() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT 1 FROM user_cards WHERE user_id = ? AND card_id = ?", (user_id, card_id))
+            exists = cur.fetchone()
+
+            current_time = int(time.time())
+            if not exists:
+                cur.execute("INSERT INTO user_cards (user_id, card_id) VALUES (?, ?)", (user_id, card_id))
+                row = cur.execute("SELECT card_mask FROM users WHERE user_id = ?", (user_id,)).fetchone()
+                mask = mask_from_blob(row[0] if row else None) | (1 << card_id)
+                cur.execute(
+                    "UPDATE users SET last_card_time = ?, card_mask = ? WHERE user_id = ?",
+                    (current_time, mask_to_blob(mask), user_id)
+                )
+            else:
+                cur.execute("UPDATE users SET last_card_time = ? WHERE user_id = ?", (current_time, user_id))
+
+        self.cooldowns.card_drawn(user_id, current_time)
+        self.users.invalidate(user_id)
         return not exists
 
+    def draw_card(self, user_id: int, rng=random) -> dict:
+        """Проверка кулдауна, выдача карточки и начисление UFCoins одной транзакцией"""
+        current_time = int(time.time())
+        with self.pool.writer() as conn:
+            # IMMEDIATE сразу берет блокировку на запись: два быстрых запроса не пройдут проверку кулдауна оба
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT nickname, last_card_time, card_mask FROM users WHERE user_id = ?", (user_id,)).fetchone()
+            if not row:
+                return {"status": "no_user"}
+
+            nickname, last_card_time, card_mask = row
+            if not nickname:
+                return {"status": "no_nickname"}
+
+            if last_card_time:
+                remaining = config.CARD_COOLDOWN - (current_time - last_card_time)
+                if remaining > 0:
+                    return {"status": "cooldown", "remaining": remaining}
+
+            card = catalog.pick(rng)
+            cur = conn.execute("INSERT OR IGNORE INTO user_cards (user_id, card_id) VALUES (?, ?)", (user_id, card["id"]))
+            is_new = cur.rowcount == 1
+            coins = card["UFCoins"] if is_new else card["UFCoins"] // 2
+            mask = mask_from_blob(card_mask) | (1 << card["id"])
+            conn.execute(
+                "UPDATE users SET last_card_time = ?, ufcoins = ufcoins + ?, record_ufcoins = MAX(record_ufcoins, ufcoins + ?), card_mask = ? WHERE user_id = ?",
+                (current_time, coins, coins, mask_to_blob(mask), user_id)
+            )
+            self._update_leaderboard(conn, user_id)
+            self.cooldowns.card_drawn(user_id, current_time)
+
+        self.pending.log_draw((user_id, card["id"], card["coolness"], coins, int(is_new), current_time))
+        self.users.invalidate(user_id)
+        return {"status": "ok", "card": card, "is_new": is_new, "coins": coins, "nickname": nickname}
+
     def add_ufcoins(self, user_id: int, amount: int):
-        conn = self.get_conn()
-        cur = conn.cursor()
+        if config.WRITE_BEHIND_COINS:
+            self.pending.add_coins(user_id, amount)
+            return
         try:
-            cur.execute(
-                "UPDATE users SET ufcoins = ufcoins + ?, record_ufcoins = MAX(record_ufcoins, ufcoins + ?) WHERE user_id = ?", 
-                (amount, amount, user_id)
-            )
-            conn.commit()
-            conn.close()
-            self.get_user.cache_clear()
+            with self.pool.writer() as conn:
+                conn.execute(
+                    "UPDATE users SET ufcoins = ufcoins + ?, record_ufcoins = MAX(record_ufcoins, ufcoins + ?) WHERE user_id = ?", 
+                    (amount, amount, user_id)
+                )
+                self._update_leaderboard(conn, user_id)
+            self.users.invalidate(user_id)
         except Exception as e:
             print(f"Error adding UFCoins: {e}")
-            conn.close()
 
     def get_user_stats(self, user_id: int):
-        conn = self.get_conn()
-        cur = conn.cursor()
-        
-        cur.execute('''
-            SELECT 
-                (SELECT COUNT(*) FROM user_cards WHERE user_id = u.user_id) as cards_count,
-                u.last_card_time,
-                u.ufcoins,
-                u.record_ufcoins,
-                u.nickname,
-                u.last_activity
-            FROM users u 
-            WHERE u.user_id = ?
-        ''', (user_id,))
-        
-        row = cur.fetchone()
-        conn.close()
-        
+        row = self.get_user_by_id(user_id)
         if not row:
             return 0, 0, 0, 0, None, 0
-            
-        cards_count, last_card_time, ufcoins, record_ufcoins, nickname, last_activity = row
-        return cards_count, last_card_time, ufcoins, record_ufcoins, nickname
+
+        user = dict(zip(USER_COLUMNS, row))
+        return row_card_mask(row).bit_count(), user["last_card_time"], user["ufcoins"], user["record_ufcoins"], user["nickname"]
+
+    def get_user_card_ids(self, user_id: int) -> Tuple[int, ...]:
+        return mask_to_ids(row_card_mask(self.get_user_by_id(user_id)))
+
+    def has_card(self, user_id: int, card_id: int) -> bool:
+        return bool(row_card_mask(self.get_user_by_id(user_id)) >> card_id & 1)
+
+    def get_missing_card_ids(self, user_id: int) -> Tuple[int, ...]:
+        return missing_card_ids(row_card_mask(self.get_user_by_id(user_id)))
 
     def get_user_cards(self, user_id: int) -> List[dict]:
-        conn = self.get_conn()
-        cur = conn.cursor()
-        cur.execute("SELECT card_id FROM user_cards WHERE user_id = ?", (user_id,))
-        
         cards = []
-        for (card_id,) in cur.fetchall():
-            if card_id in config.CARDS_DICT:
-                cards.append(config.CARDS_DICT[card_id])
+        for card_id in self.get_user_card_ids(user_id):
+            card = catalog.get(card_id)
+            if card:
+                cards.append(card)
         
-        conn.close()
         return cards
 
+    def _update_leaderboard(self, conn: sqlite3.Connection, user_id: int, new_player: bool = False):
+        # Вызывается внутри транзакции писателя, поэтому обновления топа идут в том же порядке, что и записи
+        row = conn.execute("SELECT nickname, ufcoins, record_ufcoins FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        if row:
+            self.leaderboard.update(user_id, *row, new_player=new_player)
+
+    def reload_leaderboard(self):
+        # Через писателя: leaderboard.update() вызывается внутри его транзакций, поэтому между
+        # чтением топа и load() ни одно обновление не потеряется (перечитываем редко - при старте и dirty)
+        with self.pool.writer() as conn:
+            top = conn.execute(
+                "SELECT user_id, nickname, ufcoins FROM users WHERE nickname IS NOT NULL ORDER BY ufcoins DESC, user_id LIMIT ?",
+                (self.leaderboard.size,)
+            ).fetchall()
+            record = conn.execute(
+                "SELECT user_id, nickname, record_ufcoins FROM users WHERE nickname IS NOT NULL ORDER BY record_ufcoins DESC LIMIT 1"
+            ).fetchone()
+            total = conn.execute("SELECT COUNT(*) FROM users WHERE nickname IS NOT NULL").fetchone()[0]
+        self.leaderboard.load(top, record, total)
+
     def get_rich_top(self, limit: int = 10):
-        conn = self.get_conn()
-        cur = conn.cursor()
-        cur.execute(
-            "SELECT nickname, ufcoins FROM users WHERE nickname IS NOT NULL ORDER BY ufcoins DESC LIMIT ?", 
-            (limit,)
-        )
+        rows = self.leaderboard.top(limit)
+        if rows is None and self.leaderboard.dirty:
+            self.reload_leaderboard()
+            rows = self.leaderboard.top(limit)
+        if rows is None:
+            with self.pool.reader() as conn:
+                rows = conn.execute(
+                    "SELECT nickname, ufcoins FROM users WHERE nickname IS NOT NULL ORDER BY ufcoins DESC LIMIT ?", 
+                    (limit,)
+                ).fetchall()
         
         top = []
-        for row in cur.fetchall():
+        for row in rows:
             nickname, ufcoins = row
             top.append((nickname or "<b>Аноним</b>", ufcoins))
         
-        conn.close()
         return top
 
     def get_record_holder(self):
-        conn = self.get_conn()
-        cur = conn.cursor()
-        cur.execute("SELECT nickname, record_ufcoins FROM users WHERE nickname IS NOT NULL ORDER BY record_ufcoins DESC LIMIT 1")
-        row = cur.fetchone()
-        conn.close()
+        row = self.leaderboard.record()
         return row if row and row[0] else None
 
+    def get_user_rank(self, user_id: int) -> Optional[Tuple[int, int]]:
+        """Место игрока в топе богачей и число игроков с никнеймом"""
+        row = self.get_user_by_id(user_id)
+        if not row or not row[NICKNAME_COL]:
+            return None
+
+        ufcoins = row[USER_COLUMNS.index("ufcoins")]
+        with self.pool.reader() as conn:
+            # Диапазон по частичному индексу idx_users_ufcoins, без обхода таблицы
+            above = conn.execute(
+                "SELECT COUNT(*) FROM users WHERE nickname IS NOT NULL AND ufcoins > ?", (ufcoins,)
+            ).fetchone()[0]
+        return above + 1, max(self.leaderboard.total, above + 1)
+
     def create_promo_code(self, code: str, coins: int, activations: int, created_by: str) -> Tuple[bool, str]:
-        conn = self.get_conn()
-        cur = conn.cursor()
         try:
-            cur.execute(
-                "INSERT INTO promo_codes (code, coins, max_activations, created_by, created_at) VALUES (?, ?, ?, ?, ?)",
-                (code.upper(), coins, activations, created_by, int(time.time()))
-            )
-            conn.commit()
-            conn.close()
+            with self.pool.writer() as conn:
+                conn.execute(
+                    "INSERT INTO promo_codes (code, coins, max_activations, created_by, created_at) VALUES (?, ?, ?, ?, ?)",
+                    (code.upper(), coins, activations, created_by, int(time.time()))
+                )
+            self.promo.forget(code.upper())
             return True, f"<b>✅ Код {code.upper()} создан!\n\n💰 {coins} UFCoins\n🎫 {activations} активаций</b>"
         except sqlite3.IntegrityError:
-            conn.close()
             return False, "<b>❌ промокод уже существует</b>"
         except Exception as e:
-            conn.close()
             return False, f"<b>❌ Ошибка: {str(e)}</b>"
 
     def activate_promo_code(self, user_id: int, code: str) -> Tuple[bool, str]:
-        conn = self.get_conn()
-        cur = conn.cursor()
-        try:
-            cur.execute(
-                "SELECT code_id, coins, max_activations, current_activations FROM promo_codes WHERE code = ? AND is_active = 1", 
-                (code.upper(),)
-            )
-            data = cur.fetchone()
-            
+        code = code.upper()
+        # Быстрые отказы без обращения к диску: неизвестный код или исчерпанный лимит
+        if self.promo.is_unknown(code):
+            return False, "<b>❌ код не найден или неактивен</b>"
+
+        cached = self.promo.get(code)
+        if cached is None:
+            with self.pool.reader() as conn:
+                data = conn.execute(
+                    "SELECT code_id, coins, max_activations - current_activations FROM promo_codes WHERE code = ? AND is_active = 1",
+                    (code,)
+                ).fetchone()
             if not data:
-                conn.close()
+                self.promo.remember_unknown(code)
                 return False, "<b>❌ код не найден или неактивен</b>"
-                
-            code_id, coins, max_act, curr_act = data
-            
-            if curr_act >= max_act:
-                conn.close()
-                return False, "<b>❌ лимит активаций исчерпан</b>"
-            
-            cur.execute("SELECT 1 FROM user_promo_codes WHERE user_id = ? AND code_id = ?", (user_id, code_id))
-            if cur.fetchone():
-                conn.close()
+            self.promo.remember(code, *data)
+            cached = data[:2]
+
+        code_id, coins = cached
+        if not self.promo.has_remaining(code):
+            # Писателя не трогаем, но тому, кто уже активировал код, отвечаем честно
+            with self.pool.reader() as conn:
+                activated = conn.execute(
+                    "SELECT 1 FROM user_promo_codes WHERE user_id = ? AND code_id = ?", (user_id, code_id)
+                ).fetchone()
+            if activated:
                 return False, "<b>❌ вы уже активировали этот код</b>"
+            return False, "<b>❌ лимит активаций исчерпан</b>"
 
-            current_time = int(time.time())
-            cur.execute(
-                "INSERT INTO user_promo_codes (user_id, code_id, activated_at) VALUES (?, ?, ?)", 
-                (user_id, code_id, current_time)
-            )
-            cur.execute(
-                "UPDATE promo_codes SET current_activations = current_activations + 1 WHERE code_id = ?", 
-                (code_id,)
-            )
-            cur.execute(
-                "UPDATE users SET ufcoins = ufcoins + ?, record_ufcoins = MAX(record_ufcoins, ufcoins + ?) WHERE user_id = ?", 
-                (coins, coins, user_id)
-            )
-            
-            conn.commit()
-            conn.close()
-            self.get_user.cache_clear()
+        try:
+            with self.pool.writer() as conn:
+                current_time = int(time.time())
+                cur = conn.execute(
+                    "INSERT OR IGNORE INTO user_promo_codes (user_id, code_id, activated_at) VALUES (?, ?, ?)", 
+                    (user_id, code_id, current_time)
+                )
+                if cur.rowcount == 0:
+                    return False, "<b>❌ вы уже активировали этот код</b>"
+
+                # Проверка лимита и резерв активации одним условным UPDATE - перевыдать невозможно
+                cur = conn.execute(
+                    "UPDATE promo_codes SET current_activations = current_activations + 1 "
+                    "WHERE code_id = ? AND is_active = 1 AND current_activations < max_activations",
+                    (code_id,)
+                )
+                if cur.rowcount == 0:
+                    conn.rollback()
+                    self.promo.exhaust(code)
+                    return False, "<b>❌ лимит активаций исчерпан</b>"
+
+                conn.execute(
+                    "UPDATE users SET ufcoins = ufcoins + ?, record_ufcoins = MAX(record_ufcoins, ufcoins + ?) WHERE user_id = ?", 
+                    (coins, coins, user_id)
+                )
+                self._update_leaderboard(conn, user_id)
+
+            self.promo.consumed(code)
+            self.users.invalidate(user_id)
             return True, f"<b>✅ код активирован!\n\n💳 +{coins} UFCoins</b>"
             
         except Exception as e:
-            conn.rollback()
-            conn.close()
             return False, f"<b>❌ ошибка активации: {str(e)}</b>"
 
     def update_user_activity(self, user_id: int):
-        conn = self.get_conn()
-        cur = conn.cursor()
-        current_time = int(time.time())
-        cur.execute("UPDATE users SET last_activity = ? WHERE user_id = ?", (current_time, user_id))
-        conn.commit()
-        conn.close()
-        self.get_user.cache_clear()
\ No newline at end of file
+        # Не пишет в базу сразу: значение уходит в буфер и сбрасывается пачкой
+        self.pending.touch(user_id, int(time.time()))
+
+    def _flush_pending(self, activity: dict, coins: dict, draws: list):
+        with self.pool.writer() as conn:
+            conn.executemany(
+                "INSERT INTO card_draws (user_id, card_id, coolness, coins, is_new, drawn_at) VALUES (?, ?, ?, ?, ?, ?)",
+                draws
+            )
+            conn.executemany(
+                "UPDATE users SET last_activity = MAX(last_activity, ?) WHERE user_id = ?",
+                [(timestamp, user_id) for user_id, timestamp in activity.items()]
+            )
+            conn.executemany(
+                "UPDATE users SET ufcoins = ufcoins + ?, record_ufcoins = MAX(record_ufcoins, ufcoins + ?) WHERE user_id = ?",
+                [(amount, amount, user_id) for user_id, amount in coins.items()]
+            )
+            for user_id in coins:
+                self._update_leaderboard(conn, user_id)
+
+            # Коммит, сброс кэша и очистка in-flight - под блокировкой писателя, одним шагом для читателей
+            committed = False
+            self.pending.begin_commit()
+            try:
+                conn.commit()
+                committed = True
+                for user_id, timestamp in activity.items():
+                    self.users.touch_activity(user_id, timestamp)
+                for user_id in coins:
+                    self.users.invalidate(user_id)
+            finally:
+                self.pending.end_commit(committed)
+
+    def get_card_draws(self, since: int, until: int = None, user_id: int = None, limit: int = 1000) -> list:
+        """Сырые события выдачи за [since, until): (user_id, card_id, coolness, coins, is_new, drawn_at)"""
+        until = until or int(time.time()) + 1
+        query = "SELECT user_id, card_id, coolness, coins, is_new, drawn_at FROM card_draws WHERE "
+        if user_id is not None:
+            query += "user_id = ? AND drawn_at >= ? AND drawn_at < ?"
+            params = (user_id, since, until, limit)
+        else:
+            query += "drawn_at >= ? AND drawn_at < ?"
+            params = (since, until, limit)
+        with self.pool.reader() as conn:
+            return conn.execute(query + " ORDER BY drawn_at LIMIT ?", params).fetchall()
+
+    def get_draw_counts(self, since: int, until: int = None) -> dict:
+        """Сколько раз выпадала каждая карточка за период: {card_id: (draws, new_draws, coins)}.
+
+        Свернутые дни берутся из card_draws_daily целиком, поэтому границы там округляются до суток (UTC).
+        """
+        until = until or int(time.time()) + 1
+        with self.pool.reader() as conn:
+            rows = conn.execute('''
+                SELECT card_id, SUM(draws), SUM(new_draws), SUM(coins) FROM (
+                    SELECT card_id, COUNT(*) AS draws, SUM(is_new) AS new_draws, SUM(coins) AS coins
+                    FROM card_draws WHERE drawn_at >= ? AND drawn_at < ? GROUP BY card_id
+                    UNION ALL
+                    SELECT card_id, draws, new_draws, coins FROM card_draws_daily
+                    WHERE day >= date(?, 'unixepoch') AND day < date(?, 'unixepoch')
+                ) GROUP BY card_id
+            ''', (since, until, since, until)).fetchall()
+        return {card_id: (draws, new_draws, coins) for card_id, draws, new_draws, coins in rows}
+
+    def rollup_card_draws(self, retention_days: int = config.CARD_DRAWS_RETENTION_DAYS) -> int:
+        """Сворачивает события старше retention_days в дневные счетчики и удаляет их. Возвращает число событий"""
+        # Граница по началу суток: день либо свернут целиком, либо еще лежит сырыми событиями
+        cutoff = (int(time.time()) // 86400 - retention_days) * 86400
+        with self.pool.writer() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute('''
+                INSERT INTO card_draws_daily (day, card_id, coolness, draws, new_draws, coins)
+                SELECT date(drawn_at, 'unixepoch'), card_id, MAX(coolness), COUNT(*), SUM(is_new), SUM(coins)
+                FROM card_draws WHERE drawn_at < ?
+                GROUP BY date(drawn_at, 'unixepoch'), card_id
+                ON CONFLICT (day, card_id) DO UPDATE SET
+                    draws = draws + excluded.draws,
+                    new_draws = new_draws + excluded.new_draws,
+                    coins = coins + excluded.coins
+            ''', (cutoff,))
+            return conn.execute("DELETE FROM card_draws WHERE drawn_at < ?", (cutoff,)).rowcount
+
+    def get_card_file_ids(self) -> dict:
+        with self.pool.reader() as conn:
+            rows = conn.execute("SELECT card_id, content_hash, file_id FROM card_file_ids").fetchall()
+        return {(card_id, content_hash): file_id for card_id, content_hash, file_id in rows}
+
+    def set_card_file_id(self, card_id: int, content_hash: str, file_id: str):
+        with self.pool.writer() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO card_file_ids (card_id, content_hash, file_id, updated_at) VALUES (?, ?, ?, ?)",
+                (card_id, content_hash, file_id, int(time.time()))
+            )
+
+    def delete_card_file_id(self, card_id: int, content_hash: str):
+        with self.pool.writer() as conn:
+            conn.execute("DELETE FROM card_file_ids WHERE card_id = ? AND content_hash = ?", (card_id, content_hash))
+
+    def create_broadcast(self, text: str, created_by: str, report_chat_id: int) -> int:
+        with self.pool.writer() as conn:
+            cur = conn.execute(
+                "INSERT INTO broadcasts (text, created_by, report_chat_id, created_at) VALUES (?, ?, ?, ?)",
+                (text, created_by, report_chat_id, int(time.time()))
+            )
+            return cur.lastrowid
+
+    def get_broadcast(self, broadcast_id: int) -> Optional[dict]:
+        with self.pool.reader() as conn:
+            cur = conn.execute("SELECT * FROM broadcasts WHERE broadcast_id = ?", (broadcast_id,))
+            row = cur.fetchone()
+            return dict(zip([column[0] for column in cur.description], row)) if row else None
+
+    def get_running_broadcasts(self) -> List[int]:
+        with self.pool.reader() as conn:
+            rows = conn.execute("SELECT broadcast_id FROM broadcasts WHERE status = 'running' ORDER BY broadcast_id").fetchall()
+        return [broadcast_id for (broadcast_id,) in rows]
+
+    def get_broadcast_recipients(self, after_user_id: int, limit: int) -> List[Tuple[int, int]]:
+        """Следующая пачка получателей по user_id (keyset-пагинация, без OFFSET)"""
+        with self.pool.reader() as conn:
+            return conn.execute(
+                "SELECT user_id, tg_id FROM users WHERE user_id > ? AND tg_id IS NOT NULL AND blocked = 0 ORDER BY user_id LIMIT ?",
+                (after_user_id, limit)
+            ).fetchall()
+
+    def save_broadcast_progress(self, broadcast_id: int, last_user_id: int, sent: int, failed: int, blocked: int,
+                                status: str = "running"):
+        with self.pool.writer() as conn:
+            conn.execute(
+                "UPDATE broadcasts SET last_user_id = ?, sent = ?, failed = ?, blocked = ?, status = ? WHERE broadcast_id = ?",
+                (last_user_id, sent, failed, blocked, status, broadcast_id)
+            )
+
+    def set_users_blocked(self, user_ids: List[int], blocked: bool = True):
+        with self.pool.writer() as conn:
+            conn.executemany("UPDATE users SET blocked = ? WHERE user_id = ?", [(int(blocked), user_id) for user_id in user_ids])
+        for user_id in user_ids:
+            self.users.invalidate(user_id)
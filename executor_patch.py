@@ -14,7 +14,7 @@ def start_polling(*args, **kwargs):
     print("⚠️ Fake executor called - use asyncio.run() instead")
 
 def start_webhook(*args, **kwargs):
-    print("⚠️ Fake executor called - use asyncio.run() instead")
+    print("⚠️ Fake executor called - set BOT_MODE=webhook and use asyncio.run() instead")
 
 executor_module.start_polling = start_polling
 executor_module.start_webhook = start_webhook
@@ -0,0 +1,69 @@
+import bisect
+import threading
+from typing import Optional, List, Tuple
+
+
+class Leaderboard:
+    """Топ-K богачей и рекордсмен в памяти, обновляются при каждом начислении UFCoins"""
+
+    def __init__(self, size: int = 100):
+        self.size = size
+        self._lock = threading.Lock()
+        # Отсортировано по (-ufcoins, user_id), чтобы порядок совпадал с ORDER BY ufcoins DESC
+        self._order = []
+        self._entries = {}
+        self._record = None
+        self.total = 0
+        self.dirty = True
+
+    def load(self, top: List[tuple], record: Optional[tuple], total: int):
+        """top - строки (user_id, nickname, ufcoins), record - (user_id, nickname, record_ufcoins)"""
+        with self._lock:
+            self._entries = {user_id: (nickname, ufcoins) for user_id, nickname, ufcoins in top}
+            self._order = sorted((-ufcoins, user_id) for user_id, _, ufcoins in top)
+            self._record = record
+            self.total = total
+            self.dirty = False
+
+    def _remove(self, user_id: int):
+        nickname, ufcoins = self._entries.pop(user_id)
+        index = bisect.bisect_left(self._order, (-ufcoins, user_id))
+        del self._order[index]
+
+    def update(self, user_id: int, nickname: Optional[str], ufcoins: int, record_ufcoins: int, new_player: bool = False):
+        with self._lock:
+            if new_player:
+                self.total += 1
+            if not nickname:
+                return
+
+            if user_id in self._entries:
+                old_coins = self._entries[user_id][1]
+                self._remove(user_id)
+                if ufcoins < old_coins and len(self._order) >= self.size:
+                    # Игрок мог опуститься ниже тех, кого мы не храним - перечитаем топ из индекса
+                    self.dirty = True
+
+            key = (-ufcoins, user_id)
+            if len(self._order) < self.size or key < self._order[-1]:
+                bisect.insort(self._order, key)
+                self._entries[user_id] = (nickname, ufcoins)
+                if len(self._order) > self.size:
+                    _, dropped = self._order.pop()
+                    del self._entries[dropped]
+
+            if not self._record or record_ufcoins > self._record[2] or self._record[0] == user_id:
+                self._record = (user_id, nickname, record_ufcoins)
+
+    def top(self, limit: int) -> Optional[List[Tuple[str, int]]]:
+        """Первые limit мест или None, если ответ нужно взять из базы"""
+        with self._lock:
+            if self.dirty or limit > self.size:
+                return None
+            return [self._entries[user_id] for _, user_id in self._order[:limit]]
+
+    def record(self):
+        with self._lock:
+            if self._record is None:
+                return None
+            return self._record[1], self._record[2]
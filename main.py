@@ -13,8 +13,14 @@ async def main():
     bot = TelegramBot(config.TG_TOKEN, db)
     
     # Запуск
-    print("✅ Bot initialized, starting polling...")
-    await bot.run()
+    print(f"✅ Bot initialized, starting {config.BOT_MODE}...")
+    try:
+        if config.BOT_MODE == "webhook":
+            await bot.run_webhook()
+        else:
+            await bot.run()
+    finally:
+        db.close()
 
 if __name__ == "__main__":
     try:
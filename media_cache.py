@@ -0,0 +1,161 @@
+import asyncio
+import hashlib
+import os
+from typing import Optional
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import FSInputFile, Message
+from async_database import AsyncDatabase
+from sender import bulk_sends
+
+
+def _file_hash(path: str) -> str:
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(65536), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# Ответы Bot API, после которых сохраненный file_id больше не годится
+FILE_ID_ERRORS = ("wrong file identifier", "wrong remote file identifier", "file_reference_expired", "file_id")
+
+
+def is_file_id_error(error: TelegramBadRequest) -> bool:
+    # Только эти тексты: "file is too big" или "wrong file type" не повод заново заливать картинку
+    message = str(error).lower()
+    return any(text in message for text in FILE_ID_ERRORS)
+
+
+class CardMediaCache:
+    """Кэш Telegram file_id картинок карточек: по id карточки и хэшу содержимого файла"""
+
+    def __init__(self, db: AsyncDatabase):
+        self.db = db
+        self._file_ids = None
+        self._hashes = {}
+        self._lock = asyncio.Lock()
+        # id карточек, которые уже заливаются в служебный чат: повторно в очередь их не ставим
+        self._queued = set()
+        self.uploads = 0
+        self.hits = 0
+
+    async def _load(self):
+        if self._file_ids is None:
+            async with self._lock:
+                if self._file_ids is None:
+                    self._file_ids = await self.db.get_card_file_ids()
+
+    async def content_hash(self, path: str) -> str:
+        # Хэш пересчитывается только если файл на диске поменялся
+        stat = os.stat(path)
+        signature = (stat.st_mtime_ns, stat.st_size)
+        cached = self._hashes.get(path)
+        if cached and cached[0] == signature:
+            return cached[1]
+        content_hash = await asyncio.to_thread(_file_hash, path)
+        self._hashes[path] = (signature, content_hash)
+        return content_hash
+
+    async def key(self, card: dict) -> tuple:
+        return card["id"], await self.content_hash(card["image_path"])
+
+    async def get_file_id(self, card: dict) -> Optional[str]:
+        await self._load()
+        return self._file_ids.get(await self.key(card))
+
+    async def photo(self, card: dict):
+        """file_id, если картинка уже загружалась, иначе файл с диска"""
+        file_id = await self.get_file_id(card)
+        if file_id:
+            return file_id
+        return FSInputFile(card["image_path"])
+
+    async def remember(self, card: dict, message: Message):
+        if not message or not message.photo:
+            return
+        file_id = message.photo[-1].file_id
+        key = await self.key(card)
+        await self._load()
+        if self._file_ids.get(key) == file_id:
+            return
+        self._file_ids[key] = file_id
+        await self.db.set_card_file_id(key[0], key[1], file_id)
+
+    async def forget(self, card: dict):
+        key = await self.key(card)
+        await self._load()
+        if self._file_ids.pop(key, None):
+            await self.db.delete_card_file_id(*key)
+
+    async def send(self, send, card: dict) -> Message:
+        """Отправляет картинку через send(photo), при невалидном file_id загружает файл заново"""
+        photo = await self.photo(card)
+        if isinstance(photo, str):
+            try:
+                message = await send(photo)
+                self.hits += 1
+                return message
+            except TelegramBadRequest as e:
+                if not is_file_id_error(e):
+                    raise
+                await self.forget(card)
+                photo = FSInputFile(card["image_path"])
+
+        self.uploads += 1
+        message = await send(photo)
+        await self.remember(card, message)
+        return message
+
+    def _claim(self, cards: list) -> list:
+        claimed = [card for card in {card["id"]: card for card in cards}.values() if card["id"] not in self._queued]
+        self._queued.update(card["id"] for card in claimed)
+        return claimed
+
+    def _release(self, cards: list):
+        self._queued.difference_update(card["id"] for card in cards)
+
+    async def _upload_missing(self, bot: Bot, chat_id, cards: list) -> int:
+        warmed = 0
+        for card in cards:
+            if await self.get_file_id(card):
+                continue
+            try:
+                message = await self.send(lambda photo: bot.send_photo(chat_id, photo), card)
+                warmed += 1
+                await bot.delete_message(chat_id, message.message_id)
+            except Exception as e:
+                print(f"Error warming up media cache for card {card['id']}: {e}")
+        return warmed
+
+    async def warm_up(self, bot: Bot, chat_id, cards: list) -> int:
+        """Заливает в служебный чат картинки, для которых еще нет file_id"""
+        cards = self._claim(cards)
+        try:
+            return await self._upload_missing(bot, chat_id, cards)
+        finally:
+            self._release(cards)
+
+    def prefetch(self, bot: Bot, chat_id, cards: list) -> Optional[asyncio.Task]:
+        """Фоновая задача: считает хэши картинок и, если есть служебный чат, заранее получает для них file_id.
+
+        Отправки идут с низким приоритетом, карточки, которые уже в очереди, пропускаются.
+        """
+        cards = self._claim(cards)
+        if not cards:
+            return None
+        # Задача копирует контекст при создании, так что приоритет BULK действует на все ее отправки
+        with bulk_sends():
+            return asyncio.create_task(self._prefetch(bot, chat_id, cards))
+
+    async def _prefetch(self, bot: Bot, chat_id, cards: list):
+        try:
+            if chat_id:
+                await self._upload_missing(bot, chat_id, cards)
+            else:
+                for card in cards:
+                    await self.get_file_id(card)
+        except Exception as e:
+            print(f"Error prefetching card media: {e}")
+        finally:
+            self._release(cards)
@@ -0,0 +1,151 @@
+import bisect
+import threading
+from contextvars import ContextVar
+from aiohttp import web
+
+# Счетчики запросов к базе для текущего апдейта: [запросов, секунд в запросах, секунд ожидания соединения]
+update_queries = ContextVar("update_queries", default=None)
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34)
+
+
+def _labels(names: tuple, values: tuple) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{str(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labels, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    """Гистограмма в формате Prometheus: одна запись - bisect и три сложения под блокировкой"""
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((labels, list(counts), total, count) for labels, (counts, total, count) in self._series.items())
+        for labels, counts, total, count in series:
+            names = self.labels + ("le",)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_labels(names, labels + (bound,))} {cumulative}")
+            lines.append(f"{self.name}_bucket{_labels(names, labels + ('+Inf',))} {count}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, labels)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.labels, labels)} {count}")
+        return lines
+
+
+class Gauge:
+    """Значение снимается в момент запроса /metrics"""
+
+    def __init__(self, name: str, help: str, read):
+        self.name = name
+        self.help = help
+        self.read = read
+
+    def render(self) -> list:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge", f"{self.name} {self.read()}"]
+
+
+class Metrics:
+    def __init__(self):
+        self.updates = Counter("ufc_updates_total", "Incoming updates by type", ("type",))
+        self.update_seconds = Histogram("ufc_update_seconds", "Full update processing time", ("type",))
+        self.handler_seconds = Histogram("ufc_handler_seconds", "Handler execution time", ("handler",))
+        self.handler_errors = Counter("ufc_handler_errors_total", "Handlers that raised", ("handler",))
+        self.query_seconds = Histogram("ufc_db_query_seconds", "SQLite statement time", ("statement",), QUERY_BUCKETS)
+        self.lock_wait_seconds = Histogram("ufc_db_lock_wait_seconds", "Wait for a pooled connection", ("kind",), QUERY_BUCKETS)
+        self.update_queries = Histogram("ufc_db_queries_per_update", "SQLite statements per update", (), COUNT_BUCKETS)
+        self.update_db_seconds = Histogram("ufc_db_seconds_per_update", "Time in SQLite statements per update", (), QUERY_BUCKETS)
+        self.update_lock_wait_seconds = Histogram(
+            "ufc_db_lock_wait_seconds_per_update", "Wait for pooled connections per update", (), QUERY_BUCKETS
+        )
+        self._metrics = [
+            self.updates, self.update_seconds, self.handler_seconds, self.handler_errors,
+            self.query_seconds, self.lock_wait_seconds, self.update_queries, self.update_db_seconds,
+            self.update_lock_wait_seconds,
+        ]
+
+    def add_gauge(self, name: str, help: str, read):
+        self._metrics.append(Gauge(name, help, read))
+
+    def observe_query(self, statement: str, seconds: float):
+        self.query_seconds.observe(seconds, statement)
+        stats = update_queries.get()
+        if stats is not None:
+            stats[0] += 1
+            stats[1] += seconds
+
+    def observe_wait(self, kind: str, seconds: float):
+        self.lock_wait_seconds.observe(seconds, kind)
+        stats = update_queries.get()
+        if stats is not None:
+            stats[2] += seconds
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    """Отдельный aiohttp-сервер для /metrics, по умолчанию только на localhost"""
+
+    def __init__(self, metrics: Metrics):
+        self.metrics = metrics
+        self._runner = None
+        self.app = web.Application()
+        self.app.router.add_get("/metrics", self.handle)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        return web.Response(text=self.metrics.render(), content_type="text/plain", charset="utf-8")
+
+    async def start(self, host: str, port: int):
+        self._runner = web.AppRunner(self.app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
@@ -0,0 +1,218 @@
+import time
+from typing import Any, Awaitable, Callable, Dict
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+from async_database import AsyncDatabase
+from metrics import Metrics, update_queries
+from sender import TokenBucket
+
+
+class ActivityMiddleware(BaseMiddleware):
+    """Отмечает last_activity игрока после каждого апдейта (через буфер отложенной записи)"""
+
+    def __init__(self, db: AsyncDatabase):
+        self.db = db
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        result = await handler(event, data)
+        user = data.get("event_from_user")
+        if user:
+            db_user = await self.db.get_user(tg_id=user.id)
+            if db_user:
+                # Только запись в память, поэтому вызываем напрямую, минуя поток-писатель
+                self.db.sync.update_user_activity(db_user[0])
+        return result
+
+
+class TextCommandMiddleware(BaseMiddleware):
+    """Разбирает русские текстовые команды одним поиском по словарю псевдонимов.
+
+    Стоит перед FSM: сообщения в группах, которые не являются командами, отбрасываются
+    сразу, без чтения состояния и прохода по фильтрам роутера.
+    """
+
+    def __init__(self, commands: Dict[str, Callable]):
+        self.commands = commands
+        self.matched = 0
+        self.skipped = 0
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        message = getattr(event, "message", None)
+        if message is None:
+            return await handler(event, data)
+
+        text = message.text or ""
+        command = self.commands.get(text.strip().lower()) if text else None
+        if command is None and message.chat.type != "private" and not text.startswith("/"):
+            self.skipped += 1
+            return None
+
+        if command is not None:
+            self.matched += 1
+        data["text_command"] = command
+        return await handler(event, data)
+
+
+def has_text_command(message, text_command: Callable = None) -> bool:
+    return text_command is not None
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """Антиспам до базы: token bucket на игрока для каждого класса команд и общий bucket на группу.
+
+    Лишние апдейты не доходят до обработчиков; на первый из них отвечаем коротким
+    заготовленным текстом, остальные молча отбрасываем, пока не появится токен.
+    Bucket группы совпадает с исходящим лимитом группы: все, что пропущено сверх него,
+    все равно ждало бы в очереди SendScheduler.
+    """
+
+    REPLY_TEXT = "<b>⏳ не так быстро</b>"
+    CALLBACK_TEXT = "⏳ не так быстро"
+
+    def __init__(self, limits: Dict[str, tuple], classes: Dict[Any, str],
+                 group_rate: float = 20 / 60, group_burst: float = 5, prune_interval: float = 60):
+        self.limits = limits
+        self.classes = classes
+        self.group_rate = group_rate
+        self.group_burst = group_burst
+        self.prune_interval = prune_interval
+        self._buckets = {}
+        self._warned = set()
+        self._pruned = time.monotonic()
+        self.passed = 0
+        self.throttled = {name: 0 for name in limits}
+
+    def _classify(self, event: Update, data: Dict[str, Any]) -> str:
+        if event.callback_query is not None:
+            return "callback"
+        command = data.get("text_command")
+        if command is None:
+            text = event.message.text or ""
+            if text.startswith("/"):
+                command = text.split(maxsplit=1)[0].split("@", 1)[0].lower()
+        return self.classes.get(command, "default")
+
+    def _take(self, key: tuple, rate: float, burst: float, now: float) -> bool:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(rate, burst)
+        return bucket.take(now)
+
+    def _prune(self, now: float):
+        if now - self._pruned < self.prune_interval:
+            return
+        self._pruned = now
+        for key in [key for key, bucket in self._buckets.items() if bucket.idle(now)]:
+            del self._buckets[key]
+            self._warned.discard(key)
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        user = data.get("event_from_user")
+        chat = data.get("event_chat")
+        if user is None or (event.message is None and event.callback_query is None):
+            return await handler(event, data)
+
+        now = time.monotonic()
+        self._prune(now)
+        name = self._classify(event, data)
+        rate, burst = self.limits.get(name, self.limits["default"])
+
+        user_key = (name, user.id)
+        allowed = self._take(user_key, rate, burst, now)
+        chat_full = False
+        if allowed and chat is not None and chat.type != "private":
+            allowed = self._take(("chat", chat.id), self.group_rate, self.group_burst, now)
+            chat_full = not allowed
+
+        if allowed:
+            self._warned.discard(user_key)
+            self.passed += 1
+            return await handler(event, data)
+
+        self.throttled[name] = self.throttled.get(name, 0) + 1
+        # Группа уперлась в исходящий лимит: ответ в чат встал бы в ту же очередь, так что молчим
+        if user_key in self._warned or (chat_full and event.callback_query is None):
+            return None
+        self._warned.add(user_key)
+        try:
+            if event.callback_query is not None:
+                await event.callback_query.answer(self.CALLBACK_TEXT)
+            else:
+                await event.message.reply(self.REPLY_TEXT)
+        except Exception:
+            pass
+        return None
+
+    def get_stats(self) -> dict:
+        return {
+            "passed": self.passed,
+            "throttled": dict(self.throttled),
+            "buckets": len(self._buckets),
+        }
+
+
+class UpdateMetricsMiddleware(BaseMiddleware):
+    """Считает апдейты по типам, полное время обработки, запросы к базе и ожидание соединений на апдейт"""
+
+    def __init__(self, metrics: Metrics):
+        self.metrics = metrics
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        update_type = event.event_type
+        self.metrics.updates.inc(update_type)
+        stats = [0, 0.0, 0.0]
+        token = update_queries.set(stats)
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            self.metrics.update_seconds.observe(time.perf_counter() - started, update_type)
+            self.metrics.update_queries.observe(stats[0])
+            self.metrics.update_db_seconds.observe(stats[1])
+            self.metrics.update_lock_wait_seconds.observe(stats[2])
+            update_queries.reset(token)
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Время выполнения каждого обработчика; регистрируется как внутренний middleware роутера"""
+
+    def __init__(self, metrics: Metrics):
+        self.metrics = metrics
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        # Русские текстовые команды идут через общий обработчик - называем их по настоящему
+        target = data.get("text_command") or data["handler"].callback
+        name = getattr(target, "__name__", "unknown")
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            self.metrics.handler_errors.inc(name)
+            raise
+        finally:
+            self.metrics.handler_seconds.observe(time.perf_counter() - started, name)
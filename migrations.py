@@ -0,0 +1,253 @@
+import argparse
+import os
+import sqlite3
+import sys
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import config
+
+
+def _columns(conn: sqlite3.Connection, table: str) -> set:
+    return {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+
+
+def _add_column(conn: sqlite3.Connection, table: str, column_def: str):
+    if column_def.split()[0] not in _columns(conn, table):
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column_def}")
+
+
+# Копии помощников из database.py на момент написания шагов: прошлая миграция не должна
+# менять смысл, если код приложения поменяется (и не должна тянуть за собой каталог карточек)
+def _normalize_nickname(nickname: str) -> str:
+    return nickname.strip().casefold()
+
+
+def _mask_to_blob(mask: int) -> bytes:
+    return mask.to_bytes((mask.bit_length() + 7) // 8, "little")
+
+
+def _base_schema(conn: sqlite3.Connection):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            tg_id INTEGER UNIQUE,
+            vk_id INTEGER UNIQUE,
+            username TEXT,
+            nickname TEXT UNIQUE,
+            ufcoins INTEGER DEFAULT 0,
+            record_ufcoins INTEGER DEFAULT 0,
+            last_card_time INTEGER DEFAULT 0,
+            last_activity INTEGER DEFAULT 0,
+            created_at INTEGER DEFAULT (strftime('%s','now'))
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS user_cards (
+            user_id INTEGER,
+            card_id INTEGER,
+            PRIMARY KEY (user_id, card_id)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS promo_codes (
+            code_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            code TEXT UNIQUE NOT NULL,
+            coins INTEGER,
+            max_activations INTEGER,
+            current_activations INTEGER DEFAULT 0,
+            created_by TEXT,
+            created_at INTEGER,
+            is_active INTEGER DEFAULT 1
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS user_promo_codes (
+            user_id INTEGER,
+            code_id INTEGER,
+            activated_at INTEGER,
+            PRIMARY KEY (user_id, code_id)
+        )
+    ''')
+    # Самые старые базы создавались без этих колонок
+    _add_column(conn, "users", "last_card_time INTEGER DEFAULT 0")
+    _add_column(conn, "users", "last_activity INTEGER DEFAULT 0")
+
+
+def _card_file_ids(conn: sqlite3.Connection):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS card_file_ids (
+            card_id INTEGER,
+            content_hash TEXT,
+            file_id TEXT NOT NULL,
+            updated_at INTEGER,
+            PRIMARY KEY (card_id, content_hash)
+        )
+    ''')
+
+
+def _leaderboard_indexes(conn: sqlite3.Connection):
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_users_ufcoins
+            ON users (ufcoins DESC, nickname) WHERE nickname IS NOT NULL
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_users_record_ufcoins
+            ON users (record_ufcoins DESC, nickname) WHERE nickname IS NOT NULL
+    ''')
+
+
+def _nickname_keys(conn: sqlite3.Connection):
+    _add_column(conn, "users", "nickname_key TEXT")
+    rows = conn.execute(
+        "SELECT user_id, nickname FROM users WHERE nickname IS NOT NULL AND nickname_key IS NULL ORDER BY user_id"
+    ).fetchall()
+    taken = {key for (key,) in conn.execute("SELECT nickname_key FROM users WHERE nickname_key IS NOT NULL")}
+    renamed = 0
+    for user_id, nickname in rows:
+        key = _normalize_nickname(nickname)
+        if key in taken:
+            # "Conor" и "conor" уже существуют: более поздний игрок получает ник с суффиксом.
+            # Ник обрезается, чтобы влезть в лимит хендлера в 20 символов; суффикс тоже может быть занят
+            base, attempt = nickname, 0
+            while key in taken:
+                suffix = f"_{user_id}" if attempt == 0 else f"_{user_id}_{attempt}"
+                nickname = base[:max(1, 20 - len(suffix))] + suffix
+                key = _normalize_nickname(nickname)
+                attempt += 1
+            renamed += 1
+        taken.add(key)
+        conn.execute("UPDATE users SET nickname = ?, nickname_key = ? WHERE user_id = ?", (nickname, key, user_id))
+    if rows:
+        print(f"Nickname keys backfilled: {len(rows)} users, {renamed} renamed")
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_users_nickname_key ON users (nickname_key)")
+
+
+def _broadcasts(conn: sqlite3.Connection):
+    _add_column(conn, "users", "blocked INTEGER DEFAULT 0")
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            broadcast_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            text TEXT NOT NULL,
+            created_by TEXT,
+            report_chat_id INTEGER,
+            created_at INTEGER,
+            last_user_id INTEGER DEFAULT 0,
+            sent INTEGER DEFAULT 0,
+            failed INTEGER DEFAULT 0,
+            blocked INTEGER DEFAULT 0,
+            status TEXT DEFAULT 'running'
+        )
+    ''')
+
+
+def _card_notifications(conn: sqlite3.Connection):
+    _add_column(conn, "users", "notify_card INTEGER DEFAULT 0")
+
+
+def _card_draws(conn: sqlite3.Connection):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS card_draws (
+            event_id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            card_id INTEGER NOT NULL,
+            coolness TEXT,
+            coins INTEGER,
+            is_new INTEGER,
+            drawn_at INTEGER NOT NULL
+        )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_card_draws_time ON card_draws (drawn_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_card_draws_user ON card_draws (user_id, drawn_at)")
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS card_draws_daily (
+            day TEXT,
+            card_id INTEGER,
+            coolness TEXT,
+            draws INTEGER DEFAULT 0,
+            new_draws INTEGER DEFAULT 0,
+            coins INTEGER DEFAULT 0,
+            PRIMARY KEY (day, card_id)
+        )
+    ''')
+
+
+def _card_masks(conn: sqlite3.Connection):
+    _add_column(conn, "users", "card_mask BLOB")
+    masks = {}
+    for user_id, card_id in conn.execute("SELECT user_id, card_id FROM user_cards"):
+        masks[user_id] = masks.get(user_id, 0) | (1 << card_id)
+    conn.executemany(
+        "UPDATE users SET card_mask = ? WHERE user_id = ?",
+        [(_mask_to_blob(mask), user_id) for user_id, mask in masks.items()]
+    )
+
+
+# (версия, описание, шаг). Новые шаги только дописываются в конец, старые не меняются
+MIGRATIONS = [
+    (1, "base schema", _base_schema),
+    (2, "card_file_ids table", _card_file_ids),
+    (3, "leaderboard indexes", _leaderboard_indexes),
+    (4, "users.nickname_key with unique index", _nickname_keys),
+    (5, "broadcasts table and users.blocked", _broadcasts),
+    (6, "users.notify_card", _card_notifications),
+    (7, "card_draws event log and daily rollup", _card_draws),
+    (8, "users.card_mask collection bitset", _card_masks),
+]
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def get_version(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def pending_migrations(conn: sqlite3.Connection) -> list:
+    version = get_version(conn)
+    return [migration for migration in MIGRATIONS if migration[0] > version]
+
+
+def migrate(conn: sqlite3.Connection, dry_run: bool = False) -> list:
+    """Применяет недостающие шаги по порядку, каждый в своей транзакции. Возвращает примененные версии"""
+    version = get_version(conn)
+    if version >= LATEST_VERSION:
+        if version > LATEST_VERSION:
+            print(f"Database schema version {version} is newer than this code ({LATEST_VERSION})")
+        return []
+
+    applied = []
+    for number, description, step in pending_migrations(conn):
+        if dry_run:
+            print(f"[dry-run] {number}: {description}")
+            applied.append(number)
+            continue
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            step(conn)
+            # user_version пишется в той же транзакции: шаг либо применен целиком, либо нет
+            conn.execute(f"PRAGMA user_version = {number}")
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        print(f"Migration {number} applied: {description}")
+        applied.append(number)
+    return applied
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Миграции схемы базы")
+    parser.add_argument("--db", default=config.DB_PATH)
+    parser.add_argument("--dry-run", action="store_true", help="только показать, какие шаги будут применены")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    try:
+        print(f"{args.db}: schema version {get_version(conn)}, latest {LATEST_VERSION}")
+        applied = migrate(conn, dry_run=args.dry_run)
+        if not applied:
+            print("Schema is up to date")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+import asyncio
+import time
+from aiogram import Bot
+from aiogram.exceptions import TelegramForbiddenError
+from async_database import AsyncDatabase
+from cooldowns import CooldownIndex
+from sender import bulk_sends
+
+
+class CardReadyNotifier:
+    """Фоновая задача, которая пишет подписчикам, когда им снова доступна карточка"""
+
+    TEXT = "🎴 <b>новая карточка уже ждет тебя!</b>\n\n<i>напиши «карта» или /card</i>"
+
+    def __init__(self, bot: Bot, db: AsyncDatabase, index: CooldownIndex, max_sleep: float = 30):
+        self.bot = bot
+        self.db = db
+        self.index = index
+        self.max_sleep = max_sleep
+        self.sent = 0
+        self._task = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+
+    async def _run(self):
+        while True:
+            now = time.time()
+            for user_id, tg_id in self.index.pop_due(now):
+                try:
+                    with bulk_sends():
+                        await self.bot.send_message(tg_id, self.TEXT)
+                    self.sent += 1
+                except TelegramForbiddenError:
+                    await self.db.set_card_notifications(user_id, False)
+                except Exception as e:
+                    print(f"Error sending card notification to {user_id}: {e}")
+
+            # Таймер, добавленный во время сна, сработает с опозданием не больше max_sleep
+            next_due = self.index.next_due()
+            delay = self.max_sleep if next_due is None else min(self.max_sleep, next_due - time.time())
+            await asyncio.sleep(max(0.1, delay))
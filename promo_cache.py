@@ -0,0 +1,60 @@
+import threading
+from ttl_cache import TTLCache
+
+
+class PromoCodeCache:
+    """Промокоды в памяти: счетчик оставшихся подтвержденных активаций и негативный кэш неизвестных кодов"""
+
+    def __init__(self, negative_ttl: float = 30, maxsize: int = 10000):
+        self._codes = {}
+        self._unknown = TTLCache(maxsize, negative_ttl)
+        self._lock = threading.Lock()
+        self.fast_rejects = 0
+
+    def get(self, code: str):
+        """(code_id, coins) или None, если код еще не загружен"""
+        entry = self._codes.get(code)
+        return (entry[0], entry[1]) if entry else None
+
+    def is_unknown(self, code: str) -> bool:
+        if self._unknown.get(code):
+            self.fast_rejects += 1
+            return True
+        return False
+
+    def remember(self, code: str, code_id: int, coins: int, remaining: int):
+        with self._lock:
+            if code not in self._codes:
+                self._codes[code] = [code_id, coins, remaining]
+
+    def remember_unknown(self, code: str):
+        self._unknown.set(code, True)
+
+    def forget(self, code: str):
+        with self._lock:
+            self._codes.pop(code, None)
+        self._unknown.pop(code)
+
+    def has_remaining(self, code: str) -> bool:
+        """False - все активации уже подтверждены базой, в нее можно не ходить"""
+        with self._lock:
+            entry = self._codes.get(code)
+            # Код успели забыть - о лимите ничего не знаем, решает база
+            if entry is None:
+                return True
+            if entry[2] <= 0:
+                self.fast_rejects += 1
+                return False
+            return True
+
+    def consumed(self, code: str):
+        with self._lock:
+            entry = self._codes.get(code)
+            if entry:
+                entry[2] -= 1
+
+    def exhaust(self, code: str):
+        with self._lock:
+            entry = self._codes.get(code)
+            if entry:
+                entry[2] = 0
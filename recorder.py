@@ -0,0 +1,133 @@
+import hashlib
+import hmac
+import json
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+# Объекты Bot API, в которых лежат id и имена людей и чатов
+PERSON_KEYS = {
+    "from", "chat", "user", "sender_chat", "sender_user", "forward_from", "forward_from_chat",
+    "via_bot", "new_chat_members", "left_chat_member",
+}
+# Это в записи не нужно совсем
+DROP_KEYS = {
+    "contact", "location", "venue", "phone_number", "last_name", "bio", "photo", "document", "voice", "video", "sticker",
+    "sender_user_name", "author_signature", "forward_sender_name", "forward_signature",
+}
+
+
+CHAT_TYPES = {"private", "group", "supergroup", "channel"}
+
+
+def is_person(value: dict) -> bool:
+    # Новые поля Bot API с людьми и чатами тоже анонимизируем: User узнается по is_bot/first_name, Chat - по type
+    if "id" not in value:
+        return False
+    return "is_bot" in value or "first_name" in value or value.get("type") in CHAT_TYPES
+
+
+def anonymize_id(value: int, salt: bytes) -> int:
+    """Стабильная замена id: один и тот же игрок в записи и в снимке базы получает один и тот же id"""
+    digest = hmac.new(salt, str(abs(value)).encode(), hashlib.sha256).digest()
+    anonymized = int.from_bytes(digest[:6], "big") or 1
+    # Знак сохраняем: отрицательный id - группа, от этого зависят лимиты и фильтры
+    return -anonymized if value < 0 else anonymized
+
+
+class UpdateRecorder(BaseMiddleware):
+    """Пишет входящие апдейты в JSONL (анонимно), с буферизацией и ротацией файлов.
+
+    Строка файла: {"t": время получения, "update": апдейт в формате Bot API}. Такой файл
+    проигрывает benchmarks/replay.py.
+    """
+
+    def __init__(self, path: str, salt: bytes, keep_texts: set = frozenset(),
+                 max_bytes: int = 50 * 1024 * 1024, backups: int = 10,
+                 flush_interval: float = 1.0, buffer_size: int = 500):
+        self.path = path
+        self.salt = salt
+        self.keep_texts = keep_texts
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.flush_interval = flush_interval
+        self.buffer_size = buffer_size
+        self._buffer = []
+        self._flushed = time.monotonic()
+        self.recorded = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def _scrub_text(self, text: str) -> str:
+        # Команды и псевдонимы нужны для воспроизведения, остальной текст заменяем строкой той же длины
+        if text.startswith("/") or text.strip().lower() in self.keep_texts:
+            return text
+        return "x" * len(text)
+
+    def _scrub(self, value, person: bool = False):
+        if isinstance(value, list):
+            return [self._scrub(item, person) for item in value]
+        if not isinstance(value, dict):
+            return value
+
+        person = person or is_person(value)
+        result = {}
+        for key, item in value.items():
+            if key in DROP_KEYS:
+                continue
+            if person and key == "id":
+                result[key] = anonymize_id(item, self.salt)
+            elif person and key in ("first_name", "title"):
+                result[key] = key
+            elif person and key == "username":
+                continue
+            elif key in ("text", "caption") and isinstance(item, str):
+                result[key] = self._scrub_text(item)
+            else:
+                result[key] = self._scrub(item, key in PERSON_KEYS)
+        return result
+
+    def record(self, update: TelegramObject):
+        data = update.model_dump(mode="json", by_alias=True, exclude_none=True)
+        line = json.dumps({"t": round(time.time(), 3), "update": self._scrub(data)}, ensure_ascii=False)
+        self._buffer.append(line)
+        self.recorded += 1
+        if len(self._buffer) >= self.buffer_size or time.monotonic() - self._flushed >= self.flush_interval:
+            self.flush()
+
+    def _rotate(self):
+        for index in range(self.backups - 1, 0, -1):
+            source = f"{self.path}.{index}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{index + 1}")
+        os.replace(self.path, f"{self.path}.1")
+
+    def flush(self):
+        self._flushed = time.monotonic()
+        if not self._buffer:
+            return
+        lines, self._buffer = self._buffer, []
+        try:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write("\n".join(lines) + "\n")
+                size = f.tell()
+            if size >= self.max_bytes:
+                self._rotate()
+        except OSError as e:
+            print(f"Error writing update recording: {e}")
+
+    def close(self):
+        self.flush()
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        try:
+            self.record(event)
+        except Exception as e:
+            print(f"Error recording update: {e}")
+        return await handler(event, data)
@@ -0,0 +1,195 @@
+import asyncio
+import heapq
+import itertools
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+
+# Чем меньше число, тем раньше уходит сообщение
+INTERACTIVE = 0
+BULK = 1
+
+send_priority = ContextVar("send_priority", default=INTERACTIVE)
+
+
+@contextmanager
+def bulk_sends():
+    """Все отправки внутри блока уходят с низким приоритетом (рассылки, уведомления)"""
+    token = send_priority.set(BULK)
+    try:
+        yield
+    finally:
+        send_priority.reset(token)
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def reserve(self, now: float) -> float:
+        """Забирает токен (можно в долг) и возвращает, сколько секунд ждать до отправки"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        return max(wait, self.blocked_until - now)
+
+    def take(self, now: float) -> bool:
+        """Забирает токен, только если он есть"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    def hold(self, seconds: float):
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def idle(self, now: float) -> bool:
+        return self.blocked_until <= now and self.tokens + (now - self.updated) * self.rate >= self.capacity
+
+
+class SendScheduler(BaseRequestMiddleware):
+    """Очередь исходящих сообщений перед Bot API: общий лимит, лимиты чатов, приоритеты и RetryAfter"""
+
+    SEND_PREFIXES = ("Send", "Edit", "Copy", "Forward")
+
+    def __init__(self, global_rate: float = 30, chat_rate: float = 1, chat_burst: float = 3,
+                 group_rate: float = 20 / 60, group_burst: float = 5, max_retries: int = 3):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.group_burst = group_burst
+        self.max_retries = max_retries
+        self._chats = {}
+        self._heap = []
+        self._seq = itertools.count()
+        self._wakeup = None
+        self._worker = None
+        self._closed = False
+        self._pruned = time.monotonic()
+        self.stats = {
+            "sent": 0,
+            "retry_after": 0,
+            "dropped": 0,
+            "wait_time": [0.0, 0.0],
+            "wait_count": [0, 0],
+            "max_wait": [0.0, 0.0],
+        }
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._heap)
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            # Отрицательный id - группа или канал, у них лимит Telegram заметно строже
+            is_group = isinstance(chat_id, str) or chat_id < 0
+            if is_group:
+                bucket = TokenBucket(self.group_rate, self.group_burst)
+            else:
+                bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    def _prune(self, now: float):
+        if now - self._pruned < 60:
+            return
+        self._pruned = now
+        for chat_id in [chat_id for chat_id, bucket in self._chats.items() if bucket.idle(now)]:
+            del self._chats[chat_id]
+
+    async def _dispatch(self):
+        while True:
+            if not self._heap:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            wait = self.global_bucket.reserve(time.monotonic())
+            if wait > 0:
+                await asyncio.sleep(wait)
+
+            # Извлекаем после ожидания: пока спали, мог прийти более срочный ответ
+            _, _, future = heapq.heappop(self._heap)
+            if not future.done():
+                future.set_result(None)
+
+    async def acquire(self, chat_id, priority: int):
+        started = time.monotonic()
+        self._prune(started)
+
+        wait = self._chat_bucket(chat_id).reserve(started)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+        if self._closed:
+            raise RuntimeError("send scheduler is closed")
+        if self._worker is None or self._worker.done():
+            self._wakeup = asyncio.Event()
+            self._worker = asyncio.create_task(self._dispatch())
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._heap, (priority, next(self._seq), future))
+        self._wakeup.set()
+        await future
+
+        waited = time.monotonic() - started
+        self.stats["wait_time"][priority] += waited
+        self.stats["wait_count"][priority] += 1
+        self.stats["max_wait"][priority] = max(self.stats["max_wait"][priority], waited)
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None or not type(method).__name__.startswith(self.SEND_PREFIXES):
+            return await make_request(bot, method)
+
+        priority = send_priority.get()
+        for attempt in range(self.max_retries + 1):
+            await self.acquire(chat_id, priority)
+            try:
+                response = await make_request(bot, method)
+                self.stats["sent"] += 1
+                return response
+            except TelegramRetryAfter as e:
+                self.stats["retry_after"] += 1
+                if attempt == self.max_retries:
+                    self.stats["dropped"] += 1
+                    raise
+                # Чат замолкает на указанное время, сообщение встает в очередь заново
+                self._chat_bucket(chat_id).hold(e.retry_after)
+
+    async def close(self):
+        """Останавливает очередь при выключении: воркер отменяется, ждущие отправки получают отказ"""
+        self._closed = True
+        if self._worker:
+            self._worker.cancel()
+            await asyncio.gather(self._worker, return_exceptions=True)
+            self._worker = None
+        while self._heap:
+            _, _, future = heapq.heappop(self._heap)
+            if not future.done():
+                future.set_exception(RuntimeError("send scheduler is closed"))
+
+    def get_stats(self) -> dict:
+        stats = {
+            "queue_depth": self.queue_depth,
+            "chats": len(self._chats),
+            "sent": self.stats["sent"],
+            "retry_after": self.stats["retry_after"],
+            "dropped": self.stats["dropped"],
+        }
+        for priority, name in ((INTERACTIVE, "interactive"), (BULK, "bulk")):
+            count = self.stats["wait_count"][priority]
+            stats[f"{name}_avg_wait"] = self.stats["wait_time"][priority] / count if count else 0.0
+            stats[f"{name}_max_wait"] = self.stats["max_wait"][priority]
+        return stats
@@ -0,0 +1,157 @@
+import argparse
+import os
+import sqlite3
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import config
+from catalog import catalog
+
+try:
+    import numpy as np
+except ImportError:
+    print("simulate_economy.py needs numpy: pip install numpy")
+    sys.exit(1)
+
+
+def card_arrays(weights: dict):
+    """Вероятности и стоимость карточек каталога при заданных весах крутости"""
+    by_coolness = {}
+    for card in catalog.cards:
+        by_coolness.setdefault(card["coolness"], []).append(card)
+    total = sum(weights.get(coolness, 0) for coolness in by_coolness)
+    probabilities = np.array([
+        weights.get(card["coolness"], 0) / total / len(by_coolness[card["coolness"]])
+        for card in catalog.cards
+    ])
+    values = np.array([card["UFCoins"] for card in catalog.cards], dtype=np.int64)
+    return probabilities, values
+
+
+def load_promos(db_path: str, days: int) -> list:
+    """Промокоды из базы: (день начисления, UFCoins, число активаций), день считается от самого раннего кода"""
+    if not db_path or not os.path.exists(db_path):
+        return []
+    conn = sqlite3.connect(db_path)
+    try:
+        rows = conn.execute(
+            "SELECT coins, max_activations, created_at FROM promo_codes WHERE is_active = 1 ORDER BY created_at"
+        ).fetchall()
+    except sqlite3.OperationalError:
+        rows = []
+    finally:
+        conn.close()
+    if not rows:
+        return []
+    first = rows[0][2] or 0
+    return [
+        (min(days - 1, max(0, ((created_at or first) - first) // 86400)), coins or 0, max_activations or 0)
+        for coins, max_activations, created_at in rows
+    ]
+
+
+def parse_promo(value: str) -> tuple:
+    # "coins:activations:day"
+    coins, activations, day = (int(part) for part in value.split(":"))
+    return day, coins, activations
+
+
+def simulate(weights: dict, players: int, days: int, cooldown: int, activity: float,
+             promos: list, batch: int, seed: int) -> dict:
+    rng = np.random.default_rng(seed)
+    probabilities, values = card_arrays(weights)
+    cumulative = np.cumsum(probabilities)
+    cumulative[-1] = 1.0
+    n_cards = len(values)
+    if n_cards > 64:
+        raise SystemExit("simulate_economy.py keeps collections in uint64 masks: at most 64 cards")
+    full = np.uint64((1 << n_cards) - 1)
+    max_draws = max(1, 86400 // cooldown)
+
+    completion_days = []
+    daily_coins = np.zeros(days)
+    top = np.zeros(0, dtype=np.int64)
+
+    for start in range(0, players, batch):
+        size = min(batch, players - start)
+        # Коллекция - битовая маска по позиции карточки в каталоге, как users.card_mask
+        owned = np.zeros(size, dtype=np.uint64)
+        balance = np.zeros(size, dtype=np.int64)
+        completed_on = np.full(size, -1)
+
+        for day in range(days):
+            before = balance.sum()
+            draws = rng.binomial(max_draws, activity, size)
+            for slot in range(max_draws):
+                # Случайные числа и маски считаем только для тех, кто берет карточку в этом слоте
+                active = np.flatnonzero(draws > slot)
+                if not len(active):
+                    break
+                cards = np.searchsorted(cumulative, rng.random(len(active)), side="right")
+                bits = np.left_shift(np.uint64(1), cards.astype(np.uint64))
+                is_new = (owned[active] & bits) == 0
+                # Повтор приносит половину стоимости, как в Database.draw_card
+                balance[active] += np.where(is_new, values[cards], values[cards] // 2)
+                owned[active] |= bits
+
+            for promo_day, coins, activations in promos:
+                if promo_day == day and activations:
+                    # Активации делятся между пачками пропорционально их размеру
+                    count = min(size, round(activations * size / players))
+                    balance[rng.choice(size, count, replace=False)] += coins
+
+            done = (completed_on < 0) & (owned == full)
+            completed_on[done] = day + 1
+            daily_coins[day] += balance.sum() - before
+
+        completion_days.append(completed_on)
+        top = np.sort(np.concatenate([top, np.partition(balance, -min(10, size))[-min(10, size):]]))[-10:]
+
+    completion = np.concatenate(completion_days)
+    finished = completion[completion > 0]
+    return {
+        "completed": len(finished) / players,
+        "days_p10": float(np.percentile(finished, 10)) if len(finished) else None,
+        "days_p50": float(np.percentile(finished, 50)) if len(finished) else None,
+        "days_p90": float(np.percentile(finished, 90)) if len(finished) else None,
+        "coins_per_day": daily_coins.mean() / players,
+        "top10": top[::-1].tolist(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Офлайн-симуляция экономики: выпадение карточек и UFCoins")
+    parser.add_argument("--players", type=int, default=200_000,
+                        help="время растет линейно: ~3с на 200 тыс. игроков за 90 дней на один набор весов")
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--cooldown", type=int, default=config.CARD_COOLDOWN)
+    parser.add_argument("--activity", type=float, default=0.3, help="доля возможных карточек, которые игрок реально берет")
+    parser.add_argument("--weights", action="append", help="веса крутости через запятую, в порядке каталога; можно несколько")
+    parser.add_argument("--db", default=config.DB_PATH, help="база, из которой берутся промокоды")
+    parser.add_argument("--promo", action="append", default=[], help="дополнительный промокод coins:activations:day")
+    parser.add_argument("--batch", type=int, default=200_000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    coolness = list(catalog.weights)
+    candidates = [catalog.weights]
+    if args.weights:
+        candidates = [dict(zip(coolness, (float(w) for w in value.split(",")))) for value in args.weights]
+    promos = load_promos(args.db, args.days) + [parse_promo(value) for value in args.promo]
+
+    print(f"players {args.players}, days {args.days}, cooldown {args.cooldown}s, activity {args.activity}, promos {len(promos)}")
+    for weights in candidates:
+        started = time.perf_counter()
+        result = simulate(weights, args.players, args.days, args.cooldown, args.activity,
+                          promos, args.batch, args.seed)
+        print(f"\nweights {'/'.join(f'{w:g}' for w in weights.values())} ({time.perf_counter() - started:.1f}s)")
+        print(f"  collection completed: {result['completed'] * 100:.1f}%")
+        if result["days_p50"] is not None:
+            print(f"  days to complete p10/p50/p90: {result['days_p10']:.0f} / {result['days_p50']:.0f} / {result['days_p90']:.0f}")
+        print(f"  UFCoins per player per day: {result['coins_per_day']:.1f}")
+        print(f"  top-10 balances: {result['top10']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,40 +1,135 @@
 # telegram_bot.py
-import random
+import asyncio
+import inspect
+import os
 import time
 from aiogram import Bot, Dispatcher, types, F, Router
-from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, FSInputFile
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, InputMediaPhoto
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.filters import Command, StateFilter
+from aiogram.filters.callback_data import CallbackData
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.enums import ParseMode
 import config
-from database import Database
+from database import Database, BLOCKED_COL, USER_COLUMNS, row_card_mask
+from async_database import AsyncDatabase
+from media_cache import CardMediaCache
+from webhook import WebhookServer
+from sender import SendScheduler, bulk_sends
+from broadcast import Broadcaster
+from notifications import CardReadyNotifier
+from catalog import catalog
+from recorder import UpdateRecorder
+from metrics import Metrics, MetricsServer
+from middlewares import (
+    ActivityMiddleware, TextCommandMiddleware, ThrottlingMiddleware, UpdateMetricsMiddleware,
+    HandlerMetricsMiddleware, has_text_command
+)
 
 
 class NicknameStates(StatesGroup):
     waiting_for_nickname = State()
 
 
+class MyCardsPage(CallbackData, prefix="mycards"):
+    action: str
+    page: int
+    version: int
+
+
 class TelegramBot:
     def __init__(self, token: str, db: Database):
         from aiogram.client.default import DefaultBotProperties
         self.bot = Bot(token=token, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+        self.sender = SendScheduler(
+            global_rate=config.SEND_GLOBAL_RATE,
+            chat_rate=config.SEND_CHAT_RATE,
+            chat_burst=config.SEND_CHAT_BURST,
+            group_rate=config.SEND_GROUP_RATE,
+            group_burst=config.SEND_GROUP_BURST
+        )
+        self.bot.session.middleware(self.sender)
         self.storage = MemoryStorage()
-        self.dp = Dispatcher(storage=self.storage)
+        self.dp = Dispatcher(storage=self.storage, disable_fsm=True)
         self.router = Router()
         self.dp.include_router(self.router)
-        self.db = db
-        self.user_cards_pages = {}
-        
-        self.known_text_commands = {
-            "карточка", "карта", "карту", "карт", "боец", "карточку",
-            "статистика", "стата", "стат", "статс", "статистику",
-            "ник", "никнейм", "помощь", "хелп", "хэлп",
-            "топ", "топы", "богачи", "топа", 
-            "мои карты", "коллекция", "мой сбор", "бойцы"
+        self.db = AsyncDatabase(db)
+        self.media = CardMediaCache(self.db)
+        self._background_tasks = set()
+        self._rollup_task = None
+        self._catalog_task = None
+        self._warm_up_task = None
+        self.broadcaster = Broadcaster(
+            self.bot, self.db, config.BROADCAST_RATE, config.BROADCAST_BATCH,
+            config.BROADCAST_CHECKPOINT_SENDS, config.BROADCAST_CHECKPOINT_INTERVAL
+        )
+        self.notifier = CardReadyNotifier(self.bot, self.db, db.cooldowns)
+        
+        # Русские текстовые команды: псевдоним -> обработчик
+        text_aliases = {
+            self.card_handler: ["карточка", "карта", "карту", "карт", "боец", "карточку"],
+            self.stats_handler: ["статистика", "стата", "стат", "статс", "статистику"],
+            self.nick_handler: ["ник", "никнейм"],
+            self.help_handler: ["помощь", "хелп", "хэлп"],
+            self.tops_handler: ["топ", "топы", "богачи", "топа"],
+            self.mycards_handler: ["мои карты", "коллекция", "мой сбор", "бойцы"],
+            self.notify_handler: ["уведомления", "напоминание"],
+        }
+        self.text_commands = {
+            alias: handler
+            for handler, aliases in text_aliases.items()
+            for alias in aliases
+        }
+        self._wants_state = {
+            handler for handler in text_aliases
+            if "state" in inspect.signature(handler).parameters
         }
 
+        # Метрики: время и число апдейтов, время обработчиков, запросы к базе на апдейт
+        self.metrics = Metrics()
+        self.metrics_server = None
+        self.metrics.add_gauge("ufc_send_queue_depth", "Outgoing messages waiting in SendScheduler", lambda: self.sender.queue_depth)
+        db.pool.query_hook = self.metrics.observe_query
+        db.pool.wait_hook = self.metrics.observe_wait
+        self.dp.update.outer_middleware(UpdateMetricsMiddleware(self.metrics))
+
+        # Запись апдейтов стоит сразу за метриками, чтобы попадали и те, что отбросят фильтры ниже
+        self.recorder = None
+        if config.RECORD_UPDATES:
+            salt = config.RECORD_SALT.encode()
+            if not salt:
+                print("⚠️ RECORD_SALT is not set: recorded ids will not match an anonymized DB snapshot")
+                salt = os.urandom(16)
+            self.recorder = UpdateRecorder(
+                config.RECORD_PATH, salt,
+                keep_texts=set(self.text_commands),
+                max_bytes=config.RECORD_MAX_BYTES,
+                backups=config.RECORD_BACKUPS
+            )
+            self.dp.update.outer_middleware(self.recorder)
+
+        # Разбор текста до FSM, поэтому FSM-middleware регистрируем вручную после него
+        self.text_command_middleware = TextCommandMiddleware(self.text_commands)
+        self.dp.update.outer_middleware(self.text_command_middleware)
+        # Антиспам сразу после разбора команды: лишние апдейты не трогают ни FSM, ни базу
+        self.throttling = ThrottlingMiddleware(
+            config.THROTTLE_LIMITS,
+            {
+                self.card_handler: "card", "/card": "card",
+                self.stats_handler: "read", "/stats": "read",
+                self.tops_handler: "read", "/top": "read",
+                self.mycards_handler: "read", "/mycards": "read",
+            },
+            group_rate=config.SEND_GROUP_RATE,
+            group_burst=config.SEND_GROUP_BURST
+        )
+        self.dp.update.outer_middleware(self.throttling)
+        self.dp.update.outer_middleware(self.dp.fsm)
+        self.dp.update.outer_middleware(ActivityMiddleware(self.db))
+        self.router.message.middleware(HandlerMetricsMiddleware(self.metrics))
+        self.router.callback_query.middleware(HandlerMetricsMiddleware(self.metrics))
         self._register_handlers()
 
     def _register_handlers(self):
@@ -54,38 +149,19 @@ class TelegramBot:
         self.router.message.register(self.mycards_handler, Command("mycards"))
         self.router.message.register(self.promo_code_handler, Command("code"))
         self.router.message.register(self.code_create_handler, Command("codecreate"))
+        self.router.message.register(self.broadcast_handler, Command("broadcast"))
         self.router.message.register(self.link_handler, Command("link"))
+        self.router.message.register(self.notify_handler, Command("notify"))
         
-        # Текстовые команды (русские)
-        self.router.message.register(
-            self.card_handler,
-            F.text.lower().in_(["карточка", "карта", "карту", "карт", "боец", "карточку"])
-        )
-        self.router.message.register(
-            self.stats_handler,
-            F.text.lower().in_(["статистика", "стата", "стат", "статс", "статистику"])
-        )
-        self.router.message.register(
-            self.nick_handler,
-            F.text.lower().in_(["ник", "никнейм"])
-        )
-        self.router.message.register(
-            self.help_handler,
-            F.text.lower().in_(["помощь", "хелп", "хэлп"])
-        )
-        self.router.message.register(
-            self.tops_handler,
-            F.text.lower().in_(["топ", "топы", "богачи", "топа"])
-        )
-        self.router.message.register(
-            self.mycards_handler,
-            F.text.lower().in_(["мои карты", "коллекция", "мой сбор", "бойцы"])
-        )
+        # Текстовые команды (русские), обработчик уже найден TextCommandMiddleware
+        self.router.message.register(self.text_command_handler, has_text_command)
         
         # Callback handlers
         self.router.callback_query.register(self.start_game_handler, F.data == "start_game")
-        self.router.callback_query.register(self.mycards_next_handler, F.data == "mycards_next")
-        self.router.callback_query.register(self.mycards_prev_handler, F.data == "mycards_prev")
+        self.router.callback_query.register(self.mycards_next_handler, MyCardsPage.filter(F.action == "next"))
+        self.router.callback_query.register(self.mycards_prev_handler, MyCardsPage.filter(F.action == "prev"))
+        # Кнопки старого формата, отправленные до перехода на stateless-пагинацию
+        self.router.callback_query.register(self.mycards_expired_handler, F.data.in_({"mycards_next", "mycards_prev"}))
         self.router.callback_query.register(self.mycards_close_handler, F.data == "mycards_close")
         
         # Обработчик неизвестных команд (только в ЛС, без state)
@@ -95,6 +171,11 @@ class TelegramBot:
             StateFilter(None)
         )
 
+    async def text_command_handler(self, message: types.Message, state: FSMContext, text_command):
+        if text_command in self._wants_state:
+            return await text_command(message, state)
+        return await text_command(message)
+
     async def unknown_handler(self, message: types.Message):
         text = (message.text or "").strip()
         if text.startswith('/'):
@@ -111,7 +192,7 @@ class TelegramBot:
     async def process_nickname_input(self, message: types.Message, state: FSMContext):
         nickname = message.text.strip()
         
-        db_user = self.db.get_user(tg_id=message.from_user.id)
+        db_user = await self.db.get_user(tg_id=message.from_user.id)
         if not db_user:
             await state.clear()
             return await message.reply("❌ <b>ошибка - пользователь не найден</b>")
@@ -126,10 +207,10 @@ class TelegramBot:
         if not nickname.replace('_', '').replace(' ', '').isalnum():
             return await message.reply("❌ <b>никнейм может содержать только буквы, цифры и подчеркивания</b>\n\n✏️ <b>попробуйте еще раз:</b>")
         
-        current_nickname = self.db.get_nickname(db_user[0])
+        current_nickname = await self.db.get_nickname(db_user[0])
         is_first_nickname = current_nickname is None
         
-        success, result_message = self.db.set_nickname(db_user[0], nickname)
+        success, result_message = await self.db.set_nickname(db_user[0], nickname)
         
         if success:
             await state.clear()
@@ -156,10 +237,10 @@ class TelegramBot:
         if message.chat.type != "private":
             return await message.reply("<b>❌ эту команду нельзя использовать в чате</b>\n\n<i>используйте ее в личных сообщениях с ботом</i>")
 
-        db_user = self.db.get_user(tg_id=message.from_user.id)
+        db_user = await self.db.get_user(tg_id=message.from_user.id)
         
         if not db_user:
-            db_user = self.db.create_user(
+            db_user = await self.db.create_user(
                 tg_id=message.from_user.id,
                 vk_id=None,
                 username=message.from_user.username or f"{message.from_user.first_name} {message.from_user.last_name or ''}"
@@ -181,7 +262,11 @@ class TelegramBot:
             
             return await message.reply(welcome_text, reply_markup=keyboard)
         
-        current_nickname = self.db.get_nickname(db_user[0])
+        if db_user[BLOCKED_COL]:
+            # Игрок вернулся после блокировки бота - снова включаем его в рассылки
+            await self.db.set_users_blocked([db_user[0]], False)
+        
+        current_nickname = await self.db.get_nickname(db_user[0])
         
         if not current_nickname:
             text = """<b>➡️ чтобы начать играть в бота, тебе нужно придумать никнейм</b>
@@ -206,10 +291,10 @@ class TelegramBot:
 
     async def start_game_handler(self, callback: types.CallbackQuery, state: FSMContext):
         user_id = callback.from_user.id
-        db_user = self.db.get_user(tg_id=user_id)
+        db_user = await self.db.get_user(tg_id=user_id)
         
         if not db_user:
-            db_user = self.db.create_user(
+            db_user = await self.db.create_user(
                 tg_id=user_id,
                 vk_id=None,
                 username=callback.from_user.username or callback.from_user.first_name
@@ -219,7 +304,7 @@ class TelegramBot:
             await callback.answer("❌ Ошибка: не удалось создать пользователя", show_alert=True)
             return
         
-        current_nickname = self.db.get_nickname(db_user[0])
+        current_nickname = await self.db.get_nickname(db_user[0])
         
         if current_nickname:
             await callback.message.edit_text(
@@ -242,6 +327,7 @@ class TelegramBot:
 /card - получить карточку
 /stats - посмотреть свою статистику
 /nick - установить никнейм
+/notify - напоминание, когда карточка снова доступна
 
 ⛓ полезные ссылки:
 t.me/UFCards - официальный канал бота
@@ -255,9 +341,9 @@ t.me/UFCtexBot - техподдержка
         await message.reply(help_text)
 
     async def card_handler(self, message: types.Message):
-        db_user = self.db.get_user(tg_id=message.from_user.id)
+        db_user = await self.db.get_user(tg_id=message.from_user.id)
         if not db_user:
-            db_user = self.db.create_user(
+            db_user = await self.db.create_user(
                 tg_id=message.from_user.id,
                 vk_id=None,
                 username=message.from_user.username or f"{message.from_user.first_name} {message.from_user.last_name or ''}"
@@ -265,26 +351,21 @@ t.me/UFCtexBot - техподдержка
             if not db_user:
                 return await message.reply("❌ ошибка создания пользователя")
         
-        current_nickname = self.db.get_nickname(db_user[0])
-        if not current_nickname:
-            return await message.reply("❌ <b>сначала установи никнейм командой /start</b>")
+        draw = await self.db.draw_card(db_user[0])
         
-        can_send, time_remaining = self.db.can_send_card(db_user[0])
+        if draw["status"] == "no_nickname":
+            return await message.reply("❌ <b>сначала установи никнейм командой /start</b>")
         
-        if not can_send:
-            time_left = self.format_time(time_remaining)
+        if draw["status"] == "cooldown":
+            time_left = self.format_time(draw["remaining"])
             return await message.reply(f"🆕 <b>новую карточку можно получить через {time_left}</b>")
         
-        # Выбор карточки по весам
-        coolness = random.choices(
-            list(config.COOLNESS_WEIGHTS.keys()),
-            weights=list(config.COOLNESS_WEIGHTS.values())
-        )[0]
-        card = random.choice(config.COOLNESS_CARDS[coolness])
+        if draw["status"] != "ok":
+            return await message.reply("❌ ошибка создания пользователя")
         
-        was_new_card = self.db.add_user_card(db_user[0], card["id"])
-        coins_to_add = card["UFCoins"] if was_new_card else card["UFCoins"] // 2
-        self.db.add_ufcoins(db_user[0], coins_to_add)
+        card = draw["card"]
+        was_new_card = draw["is_new"]
+        coins_to_add = draw["coins"]
         
         if was_new_card:
             caption = "💥 <b>новая карточка!</b>\n\n"
@@ -297,25 +378,26 @@ t.me/UFCtexBot - техподдержка
         caption += "<i>получить новую карточку можно через 3 часа</i>"
         
         try:
-            photo = FSInputFile(card["image_path"])
-            await message.reply_photo(photo, caption=caption)
+            await self.media.send(lambda photo: message.reply_photo(photo, caption=caption), card)
         except Exception as e:
             await message.reply(f"❌ Ошибка загрузки картинки: {str(e)}\n\nПуть: {card['image_path']}")
 
     async def stats_handler(self, message: types.Message):
-        db_user = self.db.get_user(tg_id=message.from_user.id)
+        db_user = await self.db.get_user(tg_id=message.from_user.id)
         if not db_user:
             return await message.reply("<b>❌ пользователь не найден. Напиши /start</b>")
         
-        current_nickname = self.db.get_nickname(db_user[0])
-        if not current_nickname:
+        # Все нужное уже есть в закэшированной строке users: коллекция - битовая маска, кулдаун - в памяти
+        user = dict(zip(USER_COLUMNS, db_user))
+        if not user["nickname"]:
             return await message.reply("❌ <b>сначала установи никнейм командой /start</b>")
         
-        cards_count, last_card_time, ufcoins, record_ufcoins, nickname = self.db.get_user_stats(db_user[0])
-        can_send, time_remaining = self.db.can_send_card(db_user[0])
+        cards_count = row_card_mask(db_user).bit_count()
+        ufcoins, record_ufcoins = user["ufcoins"], user["record_ufcoins"]
+        can_send, time_remaining = self.db.sync.can_send_card(db_user[0])
         
-        display_nick = nickname or f"игрок #{db_user[0]}"
-        total_cards = len(config.CARDS)
+        display_nick = user["nickname"]
+        total_cards = len(catalog.cards)
         progress_percent = int(cards_count / total_cards * 100) if total_cards > 0 else 0
         
         if can_send:
@@ -338,11 +420,11 @@ t.me/UFCtexBot - техподдержка
         if message.chat.type != 'private':
             return await message.reply("❌ <b>эту команду нельзя использовать в чате</b>\n\n<i>используйте ее в личных сообщениях с ботом</i>")
         
-        db_user = self.db.get_user(tg_id=message.from_user.id)
+        db_user = await self.db.get_user(tg_id=message.from_user.id)
         if not db_user:
             return await message.reply("❌ пользователь не найден. Напиши /start")
             
-        current_nickname = self.db.get_nickname(db_user[0])
+        current_nickname = await self.db.get_nickname(db_user[0])
         
         if current_nickname:
             text = f"<b>текущий никнейм: {current_nickname}</b>\n\n✏️ <i>напишите новый никнейм:</i>"
@@ -354,8 +436,8 @@ t.me/UFCtexBot - техподдержка
 
     async def tops_handler(self, message: types.Message):
         try:
-            top_users = self.db.get_rich_top(10)
-            record_holder = self.db.get_record_holder()
+            top_users = await self.db.get_rich_top(10)
+            record_holder = await self.db.get_record_holder()
             
             if not top_users:
                 text = "💸 <b>топ богачей</b>\n\n📊 Пока никто не заработал UFCoins"
@@ -371,6 +453,12 @@ t.me/UFCtexBot - техподдержка
                 record_nickname, record_coins = record_holder
                 text += f"\n🏆 <i>рекорд по UFCoins - {record_nickname}, {record_coins} UFCoins</i>"
             
+            db_user = await self.db.get_user(tg_id=message.from_user.id)
+            rank = await self.db.get_user_rank(db_user[0]) if db_user else None
+            if rank:
+                place, total_players = rank
+                text += f"\n📍 <i>твое место - #{place} из {total_players}</i>"
+            
             await message.reply(text)
             
         except Exception as e:
@@ -380,11 +468,11 @@ t.me/UFCtexBot - техподдержка
         if message.chat.type != 'private':
             return await message.reply("❌ <b>эта команда доступна только в личных сообщениях с ботом</b>")
         
-        db_user = self.db.get_user(tg_id=message.from_user.id)
+        db_user = await self.db.get_user(tg_id=message.from_user.id)
         if not db_user:
             return await message.reply("❌ пользователь не найден")
             
-        user_cards = self.db.get_user_cards(db_user[0])
+        user_cards = await self.db.get_user_cards(db_user[0])
         
         if not user_cards:
             text = """📚 <b>ваша коллекция карточек</b>
@@ -394,97 +482,128 @@ t.me/UFCtexBot - техподдержка
 <b>получите первую карточку командой /card</b>"""
             return await message.reply(text)
         
-        self.user_cards_pages[message.from_user.id] = {
-            'page': 0,
-            'cards': user_cards,
-            'message_id': None
-        }
-        
-        await self._show_mycards_page(message.from_user.id, 0, message.chat.id)
+        await self._show_mycards_page(user_cards, 0, message.chat.id)
 
-    async def _show_mycards_page(self, user_id: int, page: int, chat_id: int):
-        if user_id not in self.user_cards_pages:
-            return
-        
-        data = self.user_cards_pages[user_id]
-        user_cards = data['cards']
+    async def _show_mycards_page(self, user_cards: list, page: int, chat_id: int, edit_message: types.Message = None):
         total_cards = len(user_cards)
         
         # Циклическая навигация
         page = page % total_cards
-        data['page'] = page
         
         current_card = user_cards[page]
         
         text = f"""📚 <b>ваша коллекция карточек</b>
 
 🎴 <b>карточка {page + 1} из {total_cards}</b>
-📊 <b>всего карточек: {total_cards}/{len(config.CARDS)}</b>
+📊 <b>всего карточек: {total_cards}/{len(catalog.cards)}</b>
 
 <b>{current_card['name']}</b>
 <b>крутость - {current_card['coolness']}</b>
 <b>стоимость - {current_card['UFCoins']} UFCoins</b>"""
         
+        # Вся навигация лежит в callback_data: страница и версия коллекции (число карточек)
         keyboard = InlineKeyboardMarkup(inline_keyboard=[
             [
-                InlineKeyboardButton(text="⬅️", callback_data="mycards_prev"),
+                InlineKeyboardButton(text="⬅️", callback_data=MyCardsPage(action="prev", page=page, version=total_cards).pack()),
                 InlineKeyboardButton(text=f"{page + 1}/{total_cards}", callback_data="noop"),
-                InlineKeyboardButton(text="➡️", callback_data="mycards_next")
+                InlineKeyboardButton(text="➡️", callback_data=MyCardsPage(action="next", page=page, version=total_cards).pack())
             ],
             [InlineKeyboardButton(text="❌ закрыть", callback_data="mycards_close")]
         ])
         
+        self._prefetch_mycards_media(user_cards, page)
+        
         try:
-            photo = FSInputFile(current_card["image_path"])
-            
-            if data['message_id']:
+            if edit_message:
+                # Листание - одна правка сообщения вместо удаления и новой отправки
+                try:
+                    await self.media.send(
+                        lambda photo: edit_message.edit_media(InputMediaPhoto(media=photo, caption=text), reply_markup=keyboard),
+                        current_card
+                    )
+                    return
+                except TelegramBadRequest as e:
+                    if "not modified" in str(e).lower():
+                        return
+                
                 try:
-                    await self.bot.delete_message(chat_id, data['message_id'])
+                    await edit_message.delete()
                 except:
                     pass
             
-            msg = await self.bot.send_photo(chat_id, photo, caption=text, reply_markup=keyboard)
-            data['message_id'] = msg.message_id
+            await self.media.send(
+                lambda photo: self.bot.send_photo(chat_id, photo, caption=text, reply_markup=keyboard),
+                current_card
+            )
             
         except Exception as e:
             await self.bot.send_message(chat_id, f"❌ ошибка загрузки картинки: {str(e)}")
 
-    async def mycards_next_handler(self, callback: types.CallbackQuery):
-        user_id = callback.from_user.id
-        if user_id not in self.user_cards_pages:
-            return await callback.answer("❌ Используй /mycards", show_alert=True)
-        
-        current_page = self.user_cards_pages[user_id]['page']
-        await self._show_mycards_page(user_id, current_page + 1, callback.message.chat.id)
-        await callback.answer()
+    def _prefetch_mycards_media(self, user_cards: list, page: int):
+        """Заранее готовит file_id соседних страниц, чтобы следующее листание не ждало загрузки"""
+        if len(user_cards) < 2:
+            return
+        neighbours = [user_cards[(page + 1) % len(user_cards)], user_cards[(page - 1) % len(user_cards)]]
+        task = self.media.prefetch(self.bot, config.MEDIA_CACHE_CHAT_ID, neighbours)
+        if not task:
+            return
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
 
-    async def mycards_prev_handler(self, callback: types.CallbackQuery):
-        user_id = callback.from_user.id
-        if user_id not in self.user_cards_pages:
+    async def _flip_mycards_page(self, callback: types.CallbackQuery, callback_data: MyCardsPage, step: int):
+        db_user = await self.db.get_user(tg_id=callback.from_user.id)
+        user_cards = await self.db.get_user_cards(db_user[0]) if db_user else []
+        if not user_cards:
             return await callback.answer("❌ Используй /mycards", show_alert=True)
         
-        current_page = self.user_cards_pages[user_id]['page']
-        await self._show_mycards_page(user_id, current_page - 1, callback.message.chat.id)
+        page = callback_data.page + step
+        if callback_data.version != len(user_cards):
+            # Пока листали, коллекция пополнилась - начинаем сначала
+            page = 0
+        
+        await self._show_mycards_page(user_cards, page, callback.message.chat.id, callback.message)
         await callback.answer()
 
+    async def mycards_next_handler(self, callback: types.CallbackQuery, callback_data: MyCardsPage):
+        await self._flip_mycards_page(callback, callback_data, 1)
+
+    async def mycards_prev_handler(self, callback: types.CallbackQuery, callback_data: MyCardsPage):
+        await self._flip_mycards_page(callback, callback_data, -1)
+
+    async def mycards_expired_handler(self, callback: types.CallbackQuery):
+        await callback.answer("❌ Используй /mycards", show_alert=True)
+
     async def mycards_close_handler(self, callback: types.CallbackQuery):
-        user_id = callback.from_user.id
-        if user_id in self.user_cards_pages:
-            del self.user_cards_pages[user_id]
-        
         await callback.message.delete()
         await callback.answer()
 
+    async def notify_handler(self, message: types.Message):
+        if message.chat.type != 'private':
+            return await message.reply("❌ <b>эта команда доступна только в личных сообщениях с ботом</b>")
+        
+        db_user = await self.db.get_user(tg_id=message.from_user.id)
+        if not db_user:
+            return await message.reply("❌ пользователь не найден. Напиши /start")
+        
+        enabled = not await self.db.get_card_notifications(db_user[0])
+        await self.db.set_card_notifications(db_user[0], enabled)
+        
+        if enabled:
+            text = "🔔 <b>напоминания включены</b>\n\n<i>бот напишет, как только можно будет получить новую карточку</i>"
+        else:
+            text = "🔕 <b>напоминания выключены</b>"
+        await message.reply(text)
+
     async def promo_code_handler(self, message: types.Message):
         parts = message.text.split(maxsplit=1)
         
         if len(parts) > 1:
             code = parts[1].strip()
-            db_user = self.db.get_user(tg_id=message.from_user.id)
+            db_user = await self.db.get_user(tg_id=message.from_user.id)
             if not db_user:
                 return await message.reply("❌ пользователь не найден")
                 
-            success, result = self.db.activate_promo_code(db_user[0], code)
+            success, result = await self.db.activate_promo_code(db_user[0], code)
             await message.reply(result)
         else:
             await message.reply("""🔐 <b>напишите код, который хотите использовать:</b>
@@ -504,7 +623,7 @@ t.me/UFCtexBot - техподдержка
                 coins = int(coins_str)
                 activations = int(activations_str)
                 
-                success, result = self.db.create_promo_code(
+                success, result = await self.db.create_promo_code(
                     code_name, coins, activations, f"@{username}"
                 )
                 await message.reply(result)
@@ -517,6 +636,28 @@ t.me/UFCtexBot - техподдержка
 
 <i>создаст код FREE на 100 монет с 10 активациями</i>""")
 
+    async def broadcast_handler(self, message: types.Message):
+        username = message.from_user.username or ""
+        if username not in config.ADMINS and f"@{username}" not in config.ADMINS:
+            return await message.reply("❌ недостаточно прав")
+        
+        parts = message.html_text.split(maxsplit=1)
+        
+        if len(parts) < 2:
+            return await message.reply("""📣 <b>рассылка всем игрокам:</b>
+
+<code>/broadcast ТЕКСТ</code>
+
+<i>остановить все рассылки - /broadcast stop</i>""")
+        
+        if parts[1].strip().lower() == "stop":
+            cancelled = await self.broadcaster.cancel_all()
+            return await message.reply(f"⛔️ <b>рассылки остановлены: {cancelled}</b>")
+        
+        broadcast_id = await self.db.create_broadcast(parts[1], f"@{username}", message.chat.id)
+        self.broadcaster.start(broadcast_id)
+        await message.reply(f"📣 <b>рассылка #{broadcast_id} запущена</b>")
+
     def format_time(self, seconds: int) -> str:
         if seconds <= 0:
             return "0 сек"
@@ -535,7 +676,98 @@ t.me/UFCtexBot - техподдержка
         
         return " ".join(parts)
 
+    async def _rollup_draws_loop(self):
+        """Раз в сутки сворачивает старые события выдачи карточек в дневные счетчики"""
+        while True:
+            try:
+                rolled = await self.db.rollup_card_draws()
+                if rolled:
+                    print(f"🗂 Card draws rolled up: {rolled}")
+            except Exception as e:
+                print(f"Error rolling up card draws: {e}")
+            await asyncio.sleep(86400)
+
+    async def _warm_up_media(self):
+        warmed = await self.media.warm_up(self.bot, config.MEDIA_CACHE_CHAT_ID, catalog.cards)
+        print(f"🖼 Media cache warmed up: {warmed} new file_id")
+
+    async def _prepare(self):
+        self.notifier.start()
+        self._rollup_task = asyncio.create_task(self._rollup_draws_loop())
+        self._catalog_task = asyncio.create_task(catalog.watch(config.CATALOG_RELOAD_INTERVAL))
+        resumed = await self.broadcaster.resume()
+        if resumed:
+            print(f"📣 Resumed broadcasts: {resumed}")
+
+        if config.METRICS_PORT:
+            try:
+                self.metrics_server = MetricsServer(self.metrics)
+                await self.metrics_server.start(config.METRICS_HOST, config.METRICS_PORT)
+                print(f"📈 Metrics on http://{config.METRICS_HOST}:{config.METRICS_PORT}/metrics")
+            except OSError as e:
+                self.metrics_server = None
+                print(f"Error starting metrics server: {e}")
+
+        if config.MEDIA_CACHE_CHAT_ID:
+            # Служебный чат ограничен лимитом группы (около 20 отправок в минуту), поэтому прогрев
+            # идет в фоне с низким приоритетом и не задерживает запуск
+            with bulk_sends():
+                self._warm_up_task = asyncio.create_task(self._warm_up_media())
+
+    async def _cleanup(self):
+        self.notifier.stop()
+        self._rollup_task.cancel()
+        self._catalog_task.cancel()
+        if self._warm_up_task:
+            self._warm_up_task.cancel()
+        if self.recorder:
+            self.recorder.close()
+        if self.metrics_server:
+            await self.metrics_server.stop()
+        # Рассылки сохраняют чекпоинт, пока база еще открыта, и продолжатся после запуска
+        await self.broadcaster.stop()
+        # Очередь отправки останавливаем до закрытия сессии Bot API
+        await self.sender.close()
+        await self.bot.session.close()
+        self.db.close()
+
     async def run(self):
         """Запуск бота через polling"""
+        await self._prepare()
+
         print("🤖 Starting bot with dp.start_polling...")
-        await self.dp.start_polling(self.bot)
+        try:
+            # Если раньше бот работал через вебхук, getUpdates без этого вернет конфликт
+            await self.bot.delete_webhook()
+            # Сессию закрывает _cleanup, после остановки очереди отправки
+            await self.dp.start_polling(self.bot, close_bot_session=False)
+        finally:
+            await self._cleanup()
+
+    async def run_webhook(self):
+        """Запуск бота через вебхук: aiohttp-сервер кормит апдейты в Dispatcher.feed_update"""
+        if not config.WEBHOOK_SECRET:
+            raise RuntimeError("WEBHOOK_SECRET is not set: refusing to accept unauthenticated webhook updates")
+        await self._prepare()
+
+        server = WebhookServer(
+            self.bot, self.dp, config.WEBHOOK_PATH,
+            secret=config.WEBHOOK_SECRET,
+            max_concurrent=config.WEBHOOK_MAX_CONCURRENT
+        )
+        print(f"🌐 Starting webhook server on {config.WEBHOOK_HOST}:{config.WEBHOOK_PORT}{config.WEBHOOK_PATH}...")
+        try:
+            await self.dp.emit_startup(bot=self.bot, **self.dp.workflow_data)
+            await server.start(config.WEBHOOK_HOST, config.WEBHOOK_PORT)
+            if config.WEBHOOK_URL:
+                await self.bot.set_webhook(
+                    config.WEBHOOK_URL + config.WEBHOOK_PATH,
+                    secret_token=config.WEBHOOK_SECRET,
+                    allowed_updates=self.dp.resolve_used_update_types(),
+                    max_connections=config.WEBHOOK_MAX_CONCURRENT
+                )
+            await asyncio.Event().wait()
+        finally:
+            await server.stop()
+            await self.dp.emit_shutdown(bot=self.bot, **self.dp.workflow_data)
+            await self._cleanup()
@@ -0,0 +1,40 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from database import UserCache
+
+
+def row(user_id: int) -> tuple:
+    return (user_id, 1000 + user_id, None)
+
+
+class UserCacheTest(unittest.TestCase):
+    def test_other_users_writes_do_not_block_fill(self):
+        cache = UserCache()
+        epoch = cache.epoch
+        cache.invalidate(2)
+        cache.put(row(1), epoch)
+        self.assertEqual(cache.get(user_id=1), row(1))
+
+    def test_stale_read_is_not_cached(self):
+        cache = UserCache()
+        epoch = cache.epoch
+        cache.invalidate(1)
+        cache.put(row(1), epoch)
+        self.assertIsNone(cache.get(user_id=1))
+        cache.put(row(1), cache.epoch)
+        self.assertEqual(cache.get(tg_id=1001), row(1))
+
+    def test_overflow_of_versions_stays_safe(self):
+        cache = UserCache(maxsize=2)
+        epoch = cache.epoch
+        for user_id in range(2, 6):
+            cache.invalidate(user_id)
+        cache.put(row(1), epoch)
+        self.assertIsNone(cache.get(user_id=1))
+
+
+if __name__ == "__main__":
+    unittest.main()
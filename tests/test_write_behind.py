@@ -0,0 +1,70 @@
+import os
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import config
+from database import Database, UFCOINS_COL
+
+
+class WriteBehindCoinsTest(unittest.TestCase):
+    def setUp(self):
+        self._coins, self._interval = config.WRITE_BEHIND_COINS, config.WRITE_BEHIND_INTERVAL
+        config.WRITE_BEHIND_COINS = True
+        # Сбрасываем буфер вручную, фоновый поток не должен вмешиваться
+        config.WRITE_BEHIND_INTERVAL = 3600
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db = Database(os.path.join(self.tmp.name, "test.db"))
+        self.user_id = self.db.create_user(tg_id=42, username="test")[0]
+
+    def tearDown(self):
+        self.db.close()
+        self.tmp.cleanup()
+        config.WRITE_BEHIND_COINS, config.WRITE_BEHIND_INTERVAL = self._coins, self._interval
+
+    def read_while_committed(self, drop_cache: bool) -> list:
+        """Читает баланс из другого потока, пока _flush_pending стоит сразу после COMMIT"""
+        self.db.get_user(tg_id=42)
+        self.db.add_ufcoins(self.user_id, 100)
+        balances = []
+        invalidate = self.db.users.invalidate
+
+        def blocked_invalidate(user_id):
+            if drop_cache:
+                invalidate(user_id)
+            readers = [
+                threading.Thread(target=lambda: balances.append(self.db.get_user(tg_id=42)[UFCOINS_COL])),
+                threading.Thread(target=lambda: balances.append(self.db.get_user_stats(self.user_id)[2])),
+            ]
+            for reader in readers:
+                reader.start()
+            for reader in readers:
+                reader.join(0.2)
+            invalidate(user_id)
+            self.readers = readers
+
+        self.db.users.invalidate = blocked_invalidate
+        self.db.pending.flush()
+        self.db.users.invalidate = invalidate
+        for reader in self.readers:
+            reader.join(5)
+        return balances
+
+    def test_cached_row_read_after_commit(self):
+        self.assertEqual(self.read_while_committed(drop_cache=False), [100, 100])
+
+    def test_fresh_row_read_after_commit(self):
+        self.assertEqual(self.read_while_committed(drop_cache=True), [100, 100])
+
+    def test_balance_before_and_after_flush(self):
+        self.db.add_ufcoins(self.user_id, 100)
+        self.assertEqual(self.db.get_user(tg_id=42)[UFCOINS_COL], 100)
+        self.db.pending.flush()
+        self.assertEqual(self.db.get_user(tg_id=42)[UFCOINS_COL], 100)
+        self.assertEqual(self.db.get_user_stats(self.user_id)[2], 100)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,63 @@
+import asyncio
+import hmac
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class WebhookServer:
+    """aiohttp-сервер для вебхука: сразу отвечает 200, апдейт обрабатывается в фоне.
+
+    Без секрета сервер не создается: иначе любой, кто достучится до порта, подделает апдейт
+    (в том числе админскую команду от чужого username).
+    """
+
+    def __init__(self, bot: Bot, dp: Dispatcher, path: str, secret: str, max_concurrent: int = 100):
+        if not secret:
+            raise ValueError("webhook secret is required")
+        self.bot = bot
+        self.dp = dp
+        self.path = path
+        self.secret = secret
+        self.max_concurrent = max_concurrent
+        self._tasks = set()
+        self._runner = None
+        self.app = web.Application()
+        self.app.router.add_post(path, self.handle)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), self.secret):
+            return web.Response(status=403)
+
+        if len(self._tasks) >= self.max_concurrent:
+            # Telegram повторит доставку позже - так мы не копим бесконечную очередь в памяти
+            return web.Response(status=503)
+
+        try:
+            update = Update.model_validate(await request.json(), context={"bot": self.bot})
+        except Exception:
+            return web.Response(status=400)
+
+        task = asyncio.create_task(self._process(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return web.Response()
+
+    async def _process(self, update: Update):
+        try:
+            await self.dp.feed_update(self.bot, update)
+        except Exception as e:
+            print(f"Error processing update {update.update_id}: {e}")
+
+    async def start(self, host: str, port: int):
+        self._runner = web.AppRunner(self.app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+
+    async def stop(self):
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._runner:
+            await self._runner.cleanup()